@@ -0,0 +1,85 @@
+// Stacked bar chart of legal vs illegal transactions by industry, drawn in the browser from the
+// data the server sends once (industry-bar-data, see make_stacked_illegal_legal in
+// functions/graph.py, which this mirrors): changing the country or normalizing is no request.
+
+(function() {
+    // Python's format of a float with `digits` decimals (nan and inf included): toFixed, except
+    // that exact halfway values, only possible when x * 2^(digits + 1) is an integer, round to
+    // the even digit instead of up
+    function fixed(x, digits) {
+        if (Number.isNaN(x)) {
+            return 'nan';
+        }
+        if (!Number.isFinite(x)) {
+            return x > 0 ? 'inf' : '-inf';
+        }
+        if (Number.isInteger(x * Math.pow(2, digits + 1))) {
+            var exact = x.toFixed(digits + 1);
+            var previous = exact.charAt(exact.length - (digits > 0 ? 2 : 3));
+            if (exact.slice(-1) === '5' && '02468'.indexOf(previous) >= 0) {
+                return exact.slice(0, digits > 0 ? -1 : -2);
+            }
+        }
+        return x.toFixed(digits);
+    }
+
+    function percent(x) {
+        return fixed(x * 100, 2) + '%';
+    }
+
+    // Values over the totals of both sources, matched by position like the pandas Series sum
+    // (NaN past the shorter one); zero amount totals are NaN like in the server version
+    function normalized(values, illegal, legal, zeroIsNaN) {
+        return values.map(function(value, i) {
+            var total = i < illegal.length && i < legal.length ? illegal[i] + legal[i] : NaN;
+            return value / (zeroIsNaN && total === 0 ? NaN : total);
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        industry_bar_chart: {
+            figure: function(barData, selectedCountry, normalizeClicks) {
+                if (!barData) {
+                    return window.dash_clientside.no_update;
+                }
+                var normalize = (normalizeClicks || 0) % 2 === 1;
+                var suffix = normalize ? ' (Normalized)' : '';
+                var empty = {industries: [], counts: [], amounts: []};
+                var bySource = barData.countries[selectedCountry] || {};
+                var illegal = bySource.Illegal || empty;
+                var legal = bySource.Legal || empty;
+
+                var illegalCounts = illegal.counts, legalCounts = legal.counts;
+                var illegalAmounts = illegal.amounts, legalAmounts = legal.amounts;
+                if (normalize) {
+                    illegalCounts = normalized(illegal.counts, illegal.counts, legal.counts, false);
+                    legalCounts = normalized(legal.counts, illegal.counts, legal.counts, false);
+                    illegalAmounts = normalized(illegal.amounts, illegal.amounts, legal.amounts, true);
+                    legalAmounts = normalized(legal.amounts, illegal.amounts, legal.amounts, true);
+                }
+                var countText = normalize ? percent : String;
+                var amountText = normalize ? percent : function(x) { return fixed(x, 2); };
+
+                // Trace order of make_stacked_illegal_legal_base: illegal count, legal count,
+                // illegal amount, legal amount
+                var traces = [
+                    [illegal.industries, illegalCounts, 'Illegal', 'Illegal Transactions: ', countText, normalize ? '%{y:.2%}' : '%{y}'],
+                    [legal.industries, legalCounts, 'Legal', 'Legal Transactions: ', countText, normalize ? '%{y:.2%}' : '%{y}'],
+                    [illegal.industries, illegalAmounts, 'Illegal', 'Illegal Amount: ', amountText, normalize ? '%{y:.2%}' : '%{y:.2f}'],
+                    [legal.industries, legalAmounts, 'Legal', 'Legal Amount: ', amountText, normalize ? '%{y:.2%}' : '%{y:.2f}']
+                ];
+                var figure = JSON.parse(JSON.stringify(barData.figure));
+                traces.forEach(function(trace, i) {
+                    Object.assign(figure.data[i], {
+                        x: trace[0],
+                        y: trace[1],
+                        name: trace[2] + suffix,
+                        texttemplate: trace[5],
+                        hovertext: trace[1].map(function(value) { return trace[3] + trace[4](value); })
+                    });
+                });
+                return figure;
+            }
+        }
+    });
+})();
@@ -1,27 +1,80 @@
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
+from dash import dcc, html, ctx, Patch
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import pandas as pd
+import numpy as np
 import dash_bootstrap_components as dbc
 
 import os
 
 from functions.layout import create_layout_v2
-from functions.data_processing import DataManager
-from functions.graph import make_info_folium_map, make_transaction_arrow_map, make_stacked_illegal_legal, make_cards_for_industries, make_transaction_over_time
+from functions.data_processing import (DataManager, query_date_range, total_transaction_amount, rolling_amounts, filter_flows, select_cube,
+                                       cube_frame, cube_values, layout_columns)
+from functions.downsampling import downsample_series, keeps_every_point, max_points_for_width, relayout_x_range, date_range
+from functions.figure_cache import FigureCache
+from functions.folium_store import register_folium_routes, start_folium_artifact_build
+from functions.data_watcher import DataWatcher
+from functions.memory_report import register_memory_route, memory_report
+from functions.serialization import figure_to_dict, typed_array, register_compression
+from functions.metrics import CallbackMetrics, figure_cache_collector, memory_collector
+from functions.graph import (ARROW_TRACES_START, make_arrow_map_base, arrow_map_updates, apply_arrow_map_updates,
+                             make_stacked_illegal_legal_base, stacked_illegal_legal_data, make_cards_for_industries,
+                             make_transaction_over_time)
 
-DATA_PROCESSOR = DataManager()
-data = DATA_PROCESSOR.get_data()
-gdf = DATA_PROCESSOR.geodata
-iso_a3= DATA_PROCESSOR.iso_a3_dict
+# DATA_STREAM_CHUNK_MB streams the CSV in chunks of about that size instead of loading it whole
+# (it sizes the chunks, the process's peak memory is larger, see build_streaming_snapshot)
+DATA_PROCESSOR = DataManager(stream_chunk_mb=float(os.environ.get('DATA_STREAM_CHUNK_MB', 0)) or None)
+# Read-only snapshot of the data shared by every request thread; callbacks only query it.
+# Each callback reads SNAPSHOT once, so a reload swapping it mid-request is harmless.
+SNAPSHOT = DATA_PROCESSOR.build_snapshot()
 
-FOLIUM_MAP_INFO = DATA_PROCESSOR.set_folium_data()
-_ = DATA_PROCESSOR.set_arrow_data()
+# Pre-render the folium map artifact in the background (no-op if already built)
+start_folium_artifact_build(SNAPSHOT.folium_map)
 
-MIN_DATE = data['Date'].min()
+def swap_snapshot(snapshot):
+    global SNAPSHOT
+    SNAPSHOT = snapshot
+    start_folium_artifact_build(snapshot.folium_map)
+
+# Batches appended to data/transactions.csv are loaded every DATA_RELOAD_INTERVAL seconds (0 disables).
+# Each worker keeps them as small parts of its own, next to the shared frames of the build
+DATA_WATCHER = DataWatcher(DATA_PROCESSOR, swap_snapshot, interval=float(os.environ.get('DATA_RELOAD_INTERVAL', 10)))
+
+# Figures memoized on the callback inputs and snapshot version (FIGURE_CACHE_SIZE / FIGURE_CACHE_TTL / FIGURE_CACHE_DIR)
+FIGURE_CACHE = FigureCache.from_env()
+
+# Per-callback latency, phases, response size and traces on /metrics (METRICS_LOG logs each request)
+CALLBACK_METRICS = CallbackMetrics.from_env()
+
+# Over-time panels with more points than WEBGL_POINT_THRESHOLD are drawn with WebGL (unset or
+# 'off' keeps SVG, see functions.render_benchmark to pick one)
+WEBGL_THRESHOLD = os.environ.get('WEBGL_POINT_THRESHOLD', 'off')
+WEBGL_THRESHOLD = None if WEBGL_THRESHOLD.lower() == 'off' else int(WEBGL_THRESHOLD)
 
 app = dash.Dash(__name__)
-app.layout = create_layout_v2(data)
+# Built on every page load, so date ranges and options follow the loaded data
+app.layout = lambda: create_layout_v2(layout_columns(SNAPSHOT))
+app.server.before_request(DATA_WATCHER.ensure_started)
+# The folium map and its assets are served (and cached by the browser) from /folium/<hash>/
+folium_map_url = register_folium_routes(app.server, lambda: SNAPSHOT.folium_map)
+# Shared vs private memory of the worker answering the request
+register_memory_route(app.server)
+CALLBACK_METRICS.register_routes(app.server)
+# Responses gzipped for the browsers that accept it (RESPONSE_COMPRESSION_LEVEL, 0 disables, e.g.
+# behind a proxy that compresses); registered after the metrics, which then see both sizes
+register_compression(app.server, level=int(os.environ.get('RESPONSE_COMPRESSION_LEVEL', 6)))
+CALLBACK_METRICS.add_collector(figure_cache_collector(FIGURE_CACHE))
+CALLBACK_METRICS.add_collector(memory_collector(memory_report))
+
+
+def snapshot_collector():
+    # Read once so the version and the row count come from the same snapshot
+    snapshot = SNAPSHOT
+    return [('data_snapshot_rows', 'gauge', "Transactions in the data snapshot", [({'version': snapshot.version}, snapshot.row_count)])]
+
+
+CALLBACK_METRICS.add_collector(snapshot_collector)
 
 @app.callback(
     Output('total-transactions', 'children'),
@@ -30,10 +83,12 @@ app.layout = create_layout_v2(data)
     Input('date-range-picker', 'end_date'),
     Input('country-dropdown-overview', 'value')
 )
+@CALLBACK_METRICS.instrument
 def update_overview_cards(start_date, end_date, selected_countries):
-    filtered_data = DATA_PROCESSOR.filter_data_by_date_and_country(start_date, end_date, selected_countries)
-    total_transactions = len(filtered_data)
-    total_millions = filtered_data['Amount (USD)'].sum() / 1_000_000
+    with CALLBACK_METRICS.phase('query'):
+        date_range_totals = query_date_range(SNAPSHOT, start_date, end_date, selected_countries)
+    total_transactions = date_range_totals['total_transactions']
+    total_millions = date_range_totals['total_amount'] / 1_000_000
     return f"{total_transactions:,}", f"${total_millions:,.2f}M"
 
 @app.callback(
@@ -42,13 +97,17 @@ def update_overview_cards(start_date, end_date, selected_countries):
     Input('date-range-picker', 'end_date'),
     Input('country-dropdown-overview', 'value')
 )
+@CALLBACK_METRICS.instrument
 def update_industry_cards(start_date, end_date, selected_countries):
-    filtered_data = DATA_PROCESSOR.filter_data_by_date_and_country(start_date, end_date, selected_countries)
-    total_industry_amount = DATA_PROCESSOR.data.groupby('Industry')['Amount (USD)'].sum().sum()
+    snapshot = SNAPSHOT
+    with CALLBACK_METRICS.phase('query'):
+        date_range_totals = query_date_range(snapshot, start_date, end_date, selected_countries)
+        total_industry_amount = total_transaction_amount(snapshot)
 
-    total_amount = filtered_data['Amount (USD)'].sum()
+    total_amount = date_range_totals['total_amount']
 
-    card_components = make_cards_for_industries(filtered_data)
+    with CALLBACK_METRICS.phase('figure'):
+        card_components = make_cards_for_industries(date_range_totals['industry_totals'])
     
     # Add Total card
     total_card = dbc.Card([
@@ -134,51 +193,162 @@ def update_industry_cards(start_date, end_date, selected_countries):
     return rows
 
 @app.callback(
-    Output('reported-map', 'srcDoc'),
+    Output('reported-map', 'src'),
     Input('reported-map', 'id')  # Dummy input to trigger the callback once
 )
+@CALLBACK_METRICS.instrument
 def update_folium_map(_):
-    folium_map = make_info_folium_map(**FOLIUM_MAP_INFO)
-    return folium_map
+    return folium_map_url()
 
 @app.callback(
     Output('transaction-arrow-map', 'figure'),
+    Output('arrow-map-state', 'data'),
     Input('date-picker', 'date'),
     Input('transaction-checklist', 'value'),
-    Input('country-selector', 'value')
+    Input('country-selector', 'value'),
+    State('arrow-map-state', 'data')
 )
-def update_arrow_map(selected_date, arrow_options, selected_country):
+@CALLBACK_METRICS.instrument
+def update_arrow_map(selected_date, arrow_options, selected_country, arrow_map_state):
+    snapshot = SNAPSHOT
+    updates = make_arrow_map_updates(snapshot, selected_date, arrow_options, selected_country)
+    # arrow-map-state: how many arrow traces the figure in the browser holds
+    state = {'arrow_traces': len(updates['arrows'])}
+    if not arrow_map_state:
+        # First render: the static base figure with the updates applied
+        with CALLBACK_METRICS.phase('figure'):
+            fig = apply_arrow_map_updates(make_arrow_map_base_figure(snapshot), updates)
+        return fig, state
+
+    # Afterwards only what the inputs change: the choropleth arrays, the legend visibility,
+    # the title, and the arrow traces replacing the ones the browser has
+    patched_figure = Patch()
+    for key, values in updates['choropleth'].items():
+        patched_figure['data'][0][key] = values
+    for i in range(1, ARROW_TRACES_START):
+        patched_figure['data'][i]['visible'] = updates['legend_visible']
+    patched_figure['layout']['title'] = {'text': updates['title']}
+    previous_traces = arrow_map_state['arrow_traces']
+    for i, trace in enumerate(updates['arrows'][:previous_traces]):
+        patched_figure['data'][ARROW_TRACES_START + i] = trace
+    for i in reversed(range(len(updates['arrows']), previous_traces)):
+        del patched_figure['data'][ARROW_TRACES_START + i]
+    if len(updates['arrows']) > previous_traces:
+        patched_figure['data'].extend(updates['arrows'][previous_traces:])
+    return patched_figure, state
+
+@FIGURE_CACHE.memoize
+def make_arrow_map_base_figure(snapshot):
+    return figure_to_dict(make_arrow_map_base(snapshot.geodata))
+
+@FIGURE_CACHE.memoize
+def make_arrow_map_updates(snapshot, selected_date, arrow_options, selected_country):
+    min_date = pd.Timestamp(snapshot.date_index['dates'][0]).date()
     selected_date = pd.to_datetime(selected_date).date()
-    if selected_date is None or selected_date < MIN_DATE:
-        selected_date = MIN_DATE
-    flows_info = DATA_PROCESSOR.filter_flows(arrow_options, selected_country, selected_date)
-    fig, _ = make_transaction_arrow_map(**flows_info)
-    return fig
+    if selected_date is None or selected_date < min_date:
+        selected_date = min_date
+    with CALLBACK_METRICS.phase('query'):
+        flows_info = filter_flows(snapshot, arrow_options, selected_country, selected_date)
+    with CALLBACK_METRICS.phase('figure'):
+        updates = arrow_map_updates(**flows_info)
+    return updates
 
 @app.callback(
+    Output('industry-bar-data', 'data'),
+    Input('industry-bar-data', 'id')  # Dummy input to send the data once per page load
+)
+@CALLBACK_METRICS.instrument
+def update_industry_bar_data(_):
+    return make_industry_bar_data(SNAPSHOT)
+
+@FIGURE_CACHE.memoize
+def make_industry_bar_data(snapshot):
+    # Every country's raw counts and amounts and the figure to fill with them
+    with CALLBACK_METRICS.phase('query'):
+        countries = stacked_illegal_legal_data(cube_frame(snapshot))
+    with CALLBACK_METRICS.phase('figure'):
+        base = figure_to_dict(make_stacked_illegal_legal_base())
+    return {'figure': base, 'countries': countries}
+
+# Switching the country or the normalization is drawn in the browser (assets/industry_bar_chart.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='industry_bar_chart', function_name='figure'),
     Output('industry-bar-chart', 'figure'),
+    Input('industry-bar-data', 'data'),
     Input('country-dropdown', 'value'),
     Input('normalize-button', 'n_clicks')
 )
-def update_stacked_bar_chart(selected_country, normalize_clicks, dataset=data):
-    fig = make_stacked_illegal_legal(selected_country=selected_country, normalize_clicks=normalize_clicks, dataset=dataset)
-    return fig
+
+# Width of the browser window: the time series get about one point per pixel
+app.clientside_callback(
+    "function(_) { return window.innerWidth; }",
+    Output('viewport-width', 'data'),
+    Input('viewport-width', 'id')
+)
 
 @app.callback(
     Output('transactions-over-time', 'figure'),
+    Output('transactions-over-time-range', 'data'),
     Input('industry-dropdown', 'value'),
     Input('country-dropdown-multi', 'value'),
     Input('window-size-slider', 'value'),
-    Input('date-picker', 'date')
+    Input('date-picker', 'date'),
+    Input('transactions-over-time', 'relayoutData'),
+    Input('viewport-width', 'data'),
+    State('transactions-over-time-range', 'data')
 )
-def update_transaction_information(selected_industries, country_selected, window_size, selected_date, dataset=data, iso_a3_dict=iso_a3):
+@CALLBACK_METRICS.instrument
+def update_transaction_information(selected_industries, country_selected, window_size, selected_date, relayout_data,
+                                   viewport_width, x_range):
+    # x_range: the date range the top panel shows, None when it is not zoomed
+    snapshot = SNAPSHOT
+    triggered = set(ctx.triggered_prop_ids.values())
+    if triggered == {'transactions-over-time'}:
+        changed, x_range = relayout_x_range(relayout_data)
+        if not changed:
+            raise PreventUpdate
     if not selected_industries:
-        selected_industries = dataset['Industry'].unique().tolist()
+        selected_industries = cube_values(snapshot, 'Industry')
     if not country_selected:
-        country_selected = dataset['Country'].unique().tolist()
+        country_selected = cube_values(snapshot, 'Country')
+    max_points = max_points_for_width(viewport_width)
+
+    # Zooming the top panel or dragging the window slider only changes the lines: re-send just
+    # their points, downsampled over the range shown
+    if triggered and triggered <= {'window-size-slider', 'transactions-over-time'}:
+        with CALLBACK_METRICS.phase('query'):
+            rolling_series = rolling_amounts(snapshot, selected_industries, country_selected, window_size)
+            # The slider alone keeps the dates the browser has unless downsampling picks other
+            # points for the new averages
+            send_x = triggered != {'window-size-slider'} or not keeps_every_point(rolling_series, max_points,
+                                                                                  date_range(x_range))
+            rolling_series = downsample_series(rolling_series, max_points, date_range(x_range))
+        # Encoded like the figure's own arrays (typed arrays, not lists of numbers)
+        patched_figure = Patch()
+        for i, (dates, amounts) in enumerate(rolling_series.values()):
+            if send_x:
+                patched_figure['data'][i]['x'] = typed_array(np.asarray(dates))
+            patched_figure['data'][i]['y'] = typed_array(np.asarray(amounts, dtype=float))
+        return patched_figure, x_range
+    return make_transaction_information_figure(snapshot, selected_industries, country_selected, window_size, selected_date,
+                                               max_points, x_range), x_range
+
+@FIGURE_CACHE.memoize
+def make_transaction_information_figure(snapshot, selected_industries, country_selected, window_size, selected_date,
+                                        max_points, x_range):
     selected_date = pd.to_datetime(selected_date).date()
-    fig = make_transaction_over_time(dataset=dataset, iso_a3_dict=iso_a3_dict, selected_industries=selected_industries, 
-                                     country_selected=country_selected, window_size=window_size, selected_date=selected_date)
+    with CALLBACK_METRICS.phase('query'):
+        rolling_series = rolling_amounts(snapshot, selected_industries, country_selected, window_size)
+        rolling_series = downsample_series(rolling_series, max_points, date_range(x_range))
+        selected_cube = select_cube(snapshot, {'Industry': selected_industries, 'Country': country_selected})
+    with CALLBACK_METRICS.phase('figure'):
+        fig = make_transaction_over_time(dataset=selected_cube, iso_a3_dict=snapshot.iso_a3_dict, selected_industries=selected_industries, 
+                                         country_selected=country_selected, window_size=window_size, selected_date=selected_date,
+                                         rolling_series=rolling_series, webgl_threshold=WEBGL_THRESHOLD, preselected=True)
+        # Keeps the user's zoom when the figure is updated
+        fig.update_layout(uirevision='transactions-over-time')
+        # Memoized encoded, cache hits are written out as they are
+        fig = figure_to_dict(fig)
     return fig
 
 if __name__ == '__main__':
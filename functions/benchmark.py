@@ -0,0 +1,319 @@
+import os
+import sys
+import gc
+import gzip
+import json
+import time
+import argparse
+import platform
+import datetime
+import subprocess
+
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+from functions.synthetic_data import SYNTHETIC_SIZES, generate_transactions
+from functions.memory_report import reset_peak_rss, peak_rss_mb
+
+# Scaling benchmark: times the data layer steps, the queries, the figure builders and every
+# dashboard callback (a real request through the Flask test client) on synthetic files of
+# growing size, with the peak RSS of each step. Every size runs in its own process, in a
+# working directory of its own under data/cache/benchmarks, and each run is appended to a
+# JSON history (data/cache/benchmark_history.json unless --history is given, not tracked)
+# compared with the previous run of the same size. Runs record the commit they ran on, with
+# +dirty when tracked files had uncommitted changes:
+#   python -m functions.benchmark --sizes 10k 1m
+#   python -m functions.benchmark --sizes 100m --stream-chunk-mb 256
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(ROOT, 'data', 'cache', 'benchmarks')
+BENCHMARK_HISTORY = os.path.join(ROOT, 'data', 'cache', 'benchmark_history.json')
+geometry_files = ['custom.geo.json', 'selected_countries.geojson', 'singapore.geojson']
+
+# A step this much (and at least REGRESSION_SECONDS) slower than in the previous run of the
+# same size is flagged; below that it is run to run noise
+REGRESSION_RATIO = 1.5
+REGRESSION_SECONDS = 0.005
+
+
+def timed(results, name, func, *args, repeat=1, setup=None, **kwargs):
+    # Best of repeat runs; peak RSS of the process during them
+    times = []
+    reset_peak_rss()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    results[name] = {'seconds': round(min(times), 6), 'peak_rss_mb': peak_rss_mb()}
+    return value
+
+
+def prepare_workdir(rows, seed=0):
+    # data/ with the shipped geometries and a synthetic transactions.csv, generated once
+    workdir = os.path.join(BENCHMARK_DIR, f"{rows}_{seed}")
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    for name in geometry_files:
+        link = os.path.join(data_dir, name)
+        if not os.path.exists(link):
+            os.symlink(os.path.join(ROOT, 'data', name), link)
+    csv_path = os.path.join(data_dir, 'transactions.csv')
+    if not os.path.exists(csv_path):
+        generate_transactions(csv_path, rows, seed, source=os.path.join(ROOT, 'data', 'transactions.csv'))
+    return workdir
+
+
+def layout_values(layout):
+    # Initial value of every component property, as the page sends them on load
+    components = {getattr(c, 'id', None): c for c in [layout, *layout._traverse()]}
+    return lambda component_id, prop: getattr(components[component_id], prop, None)
+
+
+def run_data_layer(results, stream_chunk_mb=None, repeat=5):
+    from functions.data_processing import (DataManager, query_date_range, rolling_amounts, filter_flows,
+                                           total_transaction_amount, select_cube, cube_frame, layout_columns)
+    from functions.transaction_store import build_transactions_store
+    from functions.geo_store import load_geo_store
+    from functions.layout import create_layout_v2
+    from functions.downsampling import downsample_series, DEFAULT_MAX_POINTS
+    from functions.graph import (make_cards_for_industries, make_transaction_arrow_map, make_stacked_illegal_legal,
+                                 stacked_illegal_legal_data, make_transaction_over_time, make_info_folium_map)
+
+    # The geometry store does not depend on the transactions, it is not timed
+    load_geo_store()
+    manager = DataManager(stream_chunk_mb=stream_chunk_mb)
+    if stream_chunk_mb:
+        snapshot = timed(results, 'build_streaming_snapshot', manager.build_streaming_snapshot)
+    else:
+        timed(results, 'build_transactions_store', build_transactions_store)
+        timed(results, 'load_data', manager.load_data)
+        timed(results, 'get_data', manager.get_data)
+        timed(results, 'set_folium_data', manager.set_folium_data)
+        timed(results, 'set_arrow_data', manager.set_arrow_data)
+        timed(results, 'set_cube', manager.set_cube)
+        timed(results, 'set_date_index', manager.set_date_index)
+        snapshot = manager.snapshot()
+
+    value = layout_values(create_layout_v2(layout_columns(snapshot)))
+    cube = cube_frame(snapshot)
+    start_date, end_date = value('date-range-picker', 'start_date'), value('date-range-picker', 'end_date')
+    countries = value('country-dropdown-overview', 'value')
+    industries = value('industry-dropdown', 'value')
+    selected_date = pd.Timestamp(snapshot.date_index['dates'][len(snapshot.date_index['dates']) // 2]).date()
+
+    date_range_totals = timed(results, 'query_date_range', query_date_range, snapshot, start_date, end_date, countries,
+                              repeat=repeat, setup=snapshot.range_cache.clear)
+    timed(results, 'total_transaction_amount', total_transaction_amount, snapshot, repeat=repeat,
+          setup=snapshot.range_cache.clear)
+    rolling_series = timed(results, 'rolling_amounts', rolling_amounts, snapshot, industries, countries,
+                           value('window-size-slider', 'value'), repeat=repeat, setup=snapshot.series_cache.clear)
+    flows_info = timed(results, 'filter_flows', filter_flows, snapshot, value('transaction-checklist', 'value'),
+                       value('country-selector', 'value'), selected_date, repeat=repeat)
+    timed(results, 'select_cube', select_cube, snapshot, {'Industry': industries, 'Country': countries}, repeat=repeat)
+    timed(results, 'downsample_series', downsample_series, rolling_series, DEFAULT_MAX_POINTS, repeat=repeat)
+
+    timed(results, 'make_cards_for_industries', make_cards_for_industries, date_range_totals['industry_totals'],
+          repeat=repeat)
+    timed(results, 'make_transaction_arrow_map', make_transaction_arrow_map, **flows_info, repeat=repeat)
+    timed(results, 'make_stacked_illegal_legal', make_stacked_illegal_legal, value('country-dropdown', 'value'),
+          value('normalize-button', 'n_clicks'), cube, repeat=repeat)
+    timed(results, 'stacked_illegal_legal_data', stacked_illegal_legal_data, cube, repeat=repeat)
+    timed(results, 'make_transaction_over_time', make_transaction_over_time, cube, snapshot.iso_a3_dict,
+          industries, countries, value('window-size-slider', 'value'), selected_date, rolling_series=rolling_series,
+          repeat=repeat)
+    timed(results, 'make_info_folium_map', make_info_folium_map, **snapshot.folium_map, processes=1)
+
+
+def callback_request(output, spec, value, changed=None):
+    inputs = [dict(i, value=value(i['id'], i['property'])) for i in spec['inputs']]
+    state = [dict(s, value=value(s['id'], s['property'])) for s in spec['state']]
+    if isinstance(spec['output'], list):
+        outputs = [{'id': o.component_id, 'property': o.component_property} for o in spec['output']]
+    else:
+        outputs = {'id': spec['output'].component_id, 'property': spec['output'].component_property}
+    return json.dumps({
+        'output': output,
+        'outputs': outputs,
+        'inputs': inputs,
+        'state': state,
+        'changedPropIds': [f"{i['id']}.{i['property']}" for i in inputs if changed is None or i['id'] in changed]
+    }, cls=PlotlyJSONEncoder)
+
+
+def run_dashboard(results, repeat=5):
+    os.environ['DATA_RELOAD_INTERVAL'] = '0'
+    os.environ.pop('FIGURE_CACHE_DIR', None)
+    dashboard = timed(results, 'dashboard startup', __import__, 'dashboard')
+    from functions.folium_store import wait_for_folium_artifact_builds
+
+    timed(results, 'folium artifact build', wait_for_folium_artifact_builds)
+    value = layout_values(dashboard.app.layout())
+    client = dashboard.app.server.test_client()
+
+    def post(payload):
+        # As a browser sends it, accepting a compressed response
+        response = client.post('/_dash-update-component', data=payload, content_type='application/json',
+                               headers={'Accept-Encoding': 'gzip'})
+        if response.status_code != 200:
+            raise RuntimeError(f"callback request failed with {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response
+
+    def response_body(response):
+        body = response.get_data()
+        return gzip.decompress(body) if response.headers.get('Content-Encoding') == 'gzip' else body
+
+    def clear_caches():
+        dashboard.FIGURE_CACHE.clear()
+        dashboard.SNAPSHOT.range_cache.clear()
+        dashboard.SNAPSHOT.series_cache.clear()
+
+    # Page load requests, without the figure cache and snapshot memos so every callback does its work
+    # (clientside callbacks have no 'callback', they never reach the server)
+    requests = {spec['callback'].__name__: callback_request(output, spec, value)
+                for output, spec in dashboard.app.callback_map.items() if 'callback' in spec}
+    output, spec = next((o, s) for o, s in dashboard.app.callback_map.items()
+                        if s.get('callback') and s['callback'].__name__ == 'update_transaction_information')
+    requests['update_transaction_information (window slider)'] = callback_request(
+        output, spec, value, changed={'window-size-slider'})
+    # Zooming the top panel to the middle half of the dates
+    dates = dashboard.SNAPSHOT.date_index['dates']
+    zoom = {'xaxis.range[0]': str(pd.Timestamp(dates[len(dates) // 4])),
+            'xaxis.range[1]': str(pd.Timestamp(dates[3 * len(dates) // 4]))}
+    requests['update_transaction_information (zoom)'] = callback_request(
+        output, spec, lambda i, p: zoom if (i, p) == ('transactions-over-time', 'relayoutData') else value(i, p),
+        changed={'transactions-over-time'})
+    # Once the arrow map is on the page, changing its inputs only sends a patch of the figure
+    output, spec = next((o, s) for o, s in dashboard.app.callback_map.items()
+                        if s.get('callback') and s['callback'].__name__ == 'update_arrow_map')
+    arrow_map_state = json.loads(response_body(post(requests['update_arrow_map'])))['response']['arrow-map-state']['data']
+    requests['update_arrow_map (patch)'] = callback_request(
+        output, spec, lambda i, p: arrow_map_state if i == 'arrow-map-state' else value(i, p), changed={'date-picker'})
+    for name, payload in requests.items():
+        response = timed(results, name, post, payload, repeat=repeat, setup=clear_caches)
+        results[name]['wire_bytes'] = len(response.get_data())
+        results[name]['response_bytes'] = len(response_body(response))
+
+    # The overview callbacks fire together on the same inputs and share their date range query
+    overview = [requests['update_overview_cards'], requests['update_industry_cards']]
+    timed(results, 'overview section (both callbacks)', lambda: [post(payload) for payload in overview],
+          repeat=repeat, setup=clear_caches)
+
+
+def run_suite(workdir, stream_chunk_mb=None, repeat=5):
+    # One size, in this process: paths under data/ are relative to the working directory
+    sys.path.insert(0, ROOT)
+    os.chdir(workdir)
+    if stream_chunk_mb:
+        os.environ['DATA_STREAM_CHUNK_MB'] = str(stream_chunk_mb)
+    results = {}
+    run_data_layer(results, stream_chunk_mb, repeat)
+    gc.collect()
+    run_dashboard(results, repeat)
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '+dirty' if changes else commit
+
+
+def load_history(path=BENCHMARK_HISTORY):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def previous_run(history, record):
+    keys = ['rows', 'seed', 'stream_chunk_mb']
+    for old in reversed(history):
+        if all(old.get(k) == record[k] for k in keys) and old.get('results'):
+            return old
+    return None
+
+
+def format_comparison(record, previous=None):
+    lines = [f"{record['size']} ({record['rows']:,} rows, {record['csv_mb']:.0f} MB CSV)"
+             + (f", compared with {previous['commit']} of {previous['timestamp'][:10]}" if previous else "")]
+    if record.get('error'):
+        return '\n'.join(lines + [f"  failed: {record['error']}"])
+    old_results = previous['results'] if previous else {}
+    for name, result in record['results'].items():
+        line = f"  {name:<50} {result['seconds'] * 1000:>12.2f} ms {result['peak_rss_mb']:>9.1f} MB"
+        # Callback responses: KB sent (gzip) of KB serialized
+        line += (f" {result['wire_bytes'] / 1024:>9.1f} / {result['response_bytes'] / 1024:>9.1f} KB"
+                 if 'wire_bytes' in result else ' ' * 25)
+        old = old_results.get(name)
+        if old and old['seconds'] > 0:
+            ratio = result['seconds'] / old['seconds']
+            line += f"  {ratio - 1:>+7.0%}"
+            if ratio > REGRESSION_RATIO and result['seconds'] - old['seconds'] > REGRESSION_SECONDS:
+                line += "  REGRESSION"
+        lines.append(line.rstrip())
+    return '\n'.join(lines)
+
+
+def run_benchmarks(sizes, seed=0, stream_chunk_mb=None, repeat=5, history_path=BENCHMARK_HISTORY):
+    history = load_history(history_path)
+    for size in sizes:
+        rows = SYNTHETIC_SIZES.get(size.lower()) or int(size)
+        workdir = prepare_workdir(rows, seed)
+        record = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'size': size,
+            'rows': rows,
+            'seed': seed,
+            'stream_chunk_mb': stream_chunk_mb,
+            'csv_mb': round(os.path.getsize(os.path.join(workdir, 'data', 'transactions.csv')) / 2**20, 1),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'machine': f"{platform.machine()}, {os.cpu_count()} cpus"
+        }
+        # Its own process, so peak memory is the size's own and an out-of-memory kill only loses this size
+        output = os.path.join(workdir, 'results.json')
+        command = [sys.executable, '-m', 'functions.benchmark', '--run', workdir, '--output', output, '--repeat', str(repeat)]
+        if stream_chunk_mb:
+            command += ['--stream-chunk-mb', str(stream_chunk_mb)]
+        if os.path.exists(output):
+            os.remove(output)
+        completed = subprocess.run(command, cwd=ROOT)
+        if completed.returncode == 0:
+            with open(output) as f:
+                record['results'] = json.load(f)
+        else:
+            record['error'] = f"exit status {completed.returncode}"
+
+        print(format_comparison(record, previous_run(history, record)), flush=True)
+        history.append(record)
+        with open(history_path, 'w') as f:
+            json.dump(history, f, indent=1)
+    return history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the data layer, figures and callbacks on synthetic data")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '1m'], help=f"row counts or {', '.join(SYNTHETIC_SIZES)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stream-chunk-mb', type=float, default=None, help="stream the CSV (needed for 100m)")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of each query, builder and callback (best kept)")
+    parser.add_argument('--history', default=BENCHMARK_HISTORY)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        results = run_suite(args.run, args.stream_chunk_mb, args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        run_benchmarks(args.sizes, args.seed, args.stream_chunk_mb, args.repeat, args.history)
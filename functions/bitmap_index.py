@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Bitmap index over the categorical columns of a frame: for every column and value, the rows
+# holding that value as a packed bit array (one bit per row, numpy packbits order). A selection
+# of values per column resolves to its rows with a bitwise OR of the value bitmaps within a
+# column and an AND across columns, over n / 8 bytes per bitmap, instead of comparing every
+# row of every filtered column; whatever runs after it only sees the selected rows.
+# Values are kept in order of first appearance, like Series.unique().
+
+def build_bitmap_index(frame, columns):
+    return append_bitmap_index({'rows': 0, 'bitmaps': {column: {} for column in columns}}, frame)
+
+
+def append_bitmap_index(index, frame):
+    # New index over the rows of index followed by the rows of frame; index is not modified
+    rows = index['rows']
+    bitmaps = {}
+    for column, by_value in index['bitmaps'].items():
+        codes, uniques = pd.factorize(frame[column])
+        code_of = {value: code for code, value in enumerate(uniques)}
+        extended = {}
+        for value in [*by_value, *(value for value in code_of if value not in by_value)]:
+            bits = by_value.get(value, np.zeros(_byte_count(rows), dtype=np.uint8))
+            extended[value] = _concat_bits(bits, rows, codes == code_of.get(value, -2))
+        bitmaps[column] = extended
+    return {'rows': rows + len(frame), 'bitmaps': bitmaps}
+
+
+def indexed_values(index, column):
+    return list(index['bitmaps'][column])
+
+
+def select_rows(index, selections):
+    # selections: {column: values (or one value)}; None leaves the column unfiltered. Positions
+    # of the rows matching every column, ascending, or None when nothing is filtered out.
+    selected = None
+    for column, values in selections.items():
+        if values is None:
+            continue
+        by_value = index['bitmaps'][column]
+        values = {values} if isinstance(values, str) else set(values)
+        if by_value.keys() <= values:
+            continue
+        column_bits = np.zeros(_byte_count(index['rows']), dtype=np.uint8)
+        for value in values & by_value.keys():
+            np.bitwise_or(column_bits, by_value[value], out=column_bits)
+        selected = column_bits if selected is None else np.bitwise_and(selected, column_bits, out=selected)
+    if selected is None:
+        return None
+    return np.flatnonzero(np.unpackbits(selected, count=index['rows']))
+
+
+def _byte_count(rows):
+    return (rows + 7) // 8
+
+
+def _concat_bits(bits, rows, mask):
+    # bits holds `rows` bits, the last byte padded with zeros: re-pack only that byte with mask
+    offset = rows % 8
+    if offset == 0:
+        return np.concatenate([bits, np.packbits(mask)])
+    tail = np.unpackbits(bits[-1:], count=offset).astype(bool)
+    return np.concatenate([bits[:-1], np.packbits(np.concatenate([tail, mask]))])
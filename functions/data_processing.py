@@ -1,55 +1,78 @@
+import threading
+from dataclasses import dataclass, field
 import pandas as pd
 import numpy as np
-import geopandas as gpd
-import osmnx as ox
+from functions.geo_store import load_geo_store
+from functions.transaction_store import (TRANSACTIONS_CSV, load_transactions_store, read_store_meta, concat_transactions,
+                                         HashingReader, iter_transactions_csv)
+from functions.flow_store import FlowStore, create_flow_store, finish_flow_store
+from functions.bitmap_index import build_bitmap_index, append_bitmap_index, select_rows, indexed_values
+
+# Dimensions of the pre-aggregated cube; every dashboard aggregate is a groupby over a subset of them
+cube_dimensions = ['Date', 'Country', 'Destination Country', 'Industry', 'Source of Money', 'Transaction Type']
+# Dimensions with a bitmap index over the cube rows (dates go through the date index)
+cube_index_columns = ['Country', 'Destination Country', 'Industry', 'Source of Money', 'Transaction Type']
+# Columns that make a flow distinct
+flow_key = ['origin_iso_a3', 'Destination Country', 'amount', 'Date']
+
+@dataclass(frozen=True, eq=False)
+class DataSnapshot:
+    # Everything the callbacks read, built once by DataManager.build_snapshot and never mutated
+    # afterwards, so any number of request threads can query it through the module functions
+    # below. A new version of the data is a new snapshot, swapped in as a whole.
+    # A streamed snapshot has no data / merge_data and the build's flows are an on-disk FlowStore.
+    # Rows appended after the build are kept apart from the build's frames, which the gunicorn
+    # workers share copy-on-write: data / merge_data are the build's, appended_data the batches,
+    # and the cube (one bitmap index per part) and in-memory flows are tuples of parts, the
+    # build's first (see DataManager.append_transactions).
+    version: str
+    row_count: int
+    data: pd.DataFrame
+    appended_data: tuple
+    geodata: pd.DataFrame
+    merge_data: pd.DataFrame
+    iso_a3_dict: dict
+    cube_parts: tuple
+    cube_indexes: tuple
+    date_index: dict
+    flows: object
+    flow_tensor: dict
+    folium_map: dict
+    # memos of daily_country_series and of query_date_range / total_transaction_amount (shared by
+    # the overview callbacks, which fire on the same inputs), private to this snapshot
+    series_cache: dict = field(default_factory=dict, repr=False)
+    range_cache: dict = field(default_factory=dict, repr=False)
+    memo_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
 
 class DataManager:
-    def __init__(self):
+    def __init__(self, stream_chunk_mb=None):
         self.data_description = "Transactions Dataset"
         self.data = None
         self.data_by_country = None
+        self.cube = None
+        self.cube_index = None
+        self.date_index = None
+        self.version = None
+        # With a chunk size the CSV is streamed in chunks instead of loaded (build_streaming_snapshot)
+        self.stream_chunk_mb = stream_chunk_mb
+        self.row_count = 0
+        self.csv_size = None
+        # Appended since the build, as parts (see _append_part): batches of rows, (cube, bitmap
+        # index) pairs, and for in-memory flows (date sorted flows, sorted flow hashes) pairs
+        self.appended_data = ()
+        self.appended_cube = ()
+        self.appended_flows = ()
 
     def load_data(self):
-        data = pd.read_csv("data/transactions.csv")
-        data['Date of Transaction'] = pd.to_datetime(data['Date of Transaction'])
-        data['Date'] = data['Date of Transaction'].dt.date
+        # Typed columnar cache of data/transactions.csv, rebuilt only when the CSV changes
+        data = load_transactions_store()
         self.data = data
         return data
 
     def load_geodata(self):
-        mapping_countries = {
-            'Brazil': 'Brazil',
-            'China': 'China',
-            'India': 'India',
-            'Russia': 'Russia',
-            'Singapore': 'Singapore',
-            'South Africa': 'South Africa',
-            'Switzerland': 'Switzerland',
-            'United Arab Emirates': 'UAE',
-            'United Kingdom': 'UK',
-            'United States of America': 'USA'}
-        # Load Singapore shapefile
-        gdf_singapore = ox.geocode_to_gdf("Singapore")
-        gdf_singapore = gdf_singapore.to_crs("EPSG:4326")          # lat/lon
-
-        poly = gdf_singapore.loc[0, 'geometry']
-
-        singapore = {'admin': 'Singapore', 'iso_a3': 'SGP', 'geometry': poly}
-
-        # Load world countries shapefile
-        world = gpd.read_file('data/custom.geo.json')
-        countries = ['United States of America', 'South Africa', 'Switzerland', 'Russia', 
-             'Brazil', 'United Kingdom', 'India', 'China', 'Singapore', 
-             'United Arab Emirates']
-        gdf_countries = world[world['admin'].isin(countries)]
-        gdf_countries = gdf_countries.drop(columns=['featurecla', 'scalerank', 'labelrank', 'sovereignt', 'sov_a3', 'adm0_dif', 'level'])
-        gdf_countries = gdf_countries[['admin', 'geometry', 'iso_a3']]
-
-        gdf_countries['admin'] = gdf_countries['admin'].map(mapping_countries)
-        gdf_countries.loc[len(gdf_countries)] = singapore
-
-        gdf_countries['rep_point'] = gdf_countries['geometry'].representative_point()
-        gdf_countries.set_crs(epsg=4326, inplace=True)
+        # Read from the local geometry store (no network access), built once from data/
+        gdf_countries = load_geo_store()
         self.geodata = gdf_countries
         return gdf_countries
 
@@ -61,10 +84,16 @@ class DataManager:
         self.iso_a3_dict = merge_data[['Country', 'iso_a3']].drop_duplicates().set_index('Country')['iso_a3'].to_dict()
         return merge_data
 
-    def set_data_by_country(self):
+    def transactions(self):
+        # The build's rows followed by the appended batches (a new frame once there are batches)
         if self.data is None:
             self.load_data()
-        self.data_by_country = {country: df for country, df in self.data.groupby('Country')}
+        if not self.appended_data:
+            return self.data
+        return concat_transactions([self.data, *self.appended_data])
+
+    def set_data_by_country(self):
+        self.data_by_country = {country: df for country, df in self.transactions().groupby('Country', observed=True)}
         return self.data_by_country
     
     def get_country_data(self, country):
@@ -72,96 +101,653 @@ class DataManager:
             self.set_data_by_country()
         return self.data_by_country.get(country, pd.DataFrame())
     
+    def set_cube(self):
+        if self.data is None:
+            self.load_data()
+        self.cube = _aggregate_cube(self.data)
+        self.set_cube_index()
+        return self.cube
+
+    def set_cube_index(self):
+        self.cube_index = build_bitmap_index(self.cube, cube_index_columns)
+        return self.cube_index
+
+    def set_date_index(self):
+        if self.cube is None:
+            self.set_cube()
+        self.date_index = _date_index_from_cube(self.cube)
+        return self.date_index
+
     def set_folium_data(self):
         clean_data = self.data[['Country', 'Reported by Authority', 'Source of Money', 'Amount (USD)', 'Transaction Type']]
         clean_data_illegal = clean_data[clean_data['Source of Money'] == 'Illegal']
-        data_country = clean_data_illegal.groupby('Country')
-        map_illegal_data = {}
-        map_transactions_data = {}
-        for country, group in data_country:
-            illegal_count = group['Reported by Authority'].sum()
-            illegal_total = len(group)
-            map_illegal_data[country] = illegal_count / illegal_total if illegal_total > 0 else 0
-
-            transaction_counts = group['Transaction Type'].value_counts().to_dict()
-            map_transactions_data[country] = transaction_counts
-
-        self.folium_map = {
-            "map_illegal_data": map_illegal_data,
-            "map_transactions_data": map_transactions_data,
-            "clean_data_illegal": clean_data_illegal,
-            "geo_data": self.geodata
-        }
+        self.folium_counts = _folium_counts(clean_data_illegal)
+        self.folium_map = _folium_map(self.folium_counts, _illegal_amounts(clean_data_illegal), self.geodata)
         return self.folium_map
 
     def set_arrow_data(self):
-        # Obtenemos coordenadas (lat/lon) a partir del punto representativo
-        transaction = self.merge_data
-        transaction_info = transaction[['iso_a3', 'rep_point', 'Destination Country', 'Amount (USD)', 'Date']].drop_duplicates()
-
-        transaction_info['rep_point_origin'] = transaction_info['rep_point']
-        transaction_info['rep_point_destination'] = transaction_info['Destination Country'].map(self.geodata.set_index('admin')['rep_point'])
-
-        transaction_info['o_lat'] = transaction_info['rep_point_origin'].apply(lambda point: point.y)
-        transaction_info['o_lon'] = transaction_info['rep_point_origin'].apply(lambda point: point.x)
-        transaction_info['d_lat'] = transaction_info['rep_point_destination'].apply(lambda point: point.y)
-        transaction_info['d_lon'] = transaction_info['rep_point_destination'].apply(lambda point: point.x)
-
-        transaction_info['iso_a3_dest'] = transaction_info['Destination Country'].map(self.iso_a3_dict)
-
-        # obtain origin and destination coordinates
-        flows_df = pd.DataFrame(transaction_info)
-        flows = flows_df.rename(columns={'Amount (USD)': 'amount', 'iso_a3': 'origin_iso_a3', 'iso_a3_dest': 'dest_iso_a3'})
-        self.flows = flows
-        return flows
-
-    def filter_flows(self, arrow_options, country, date):
-        flows_on_date = self.flows[self.flows['Date'] == pd.to_datetime(date).date()]
-
-        # Filter based on country and arrow options
-        if country != 'ALL':
-            if 'origin' in arrow_options and 'destiny' not in arrow_options:
-                flows_on_date = flows_on_date[flows_on_date['origin_iso_a3'] == self.iso_a3_dict[country]]
-            elif 'destiny' in arrow_options and 'origin' not in arrow_options:
-                flows_on_date = flows_on_date[flows_on_date['dest_iso_a3'] == self.iso_a3_dict[country]]
-            else:
-                flows_on_date = flows_on_date[(flows_on_date['origin_iso_a3'] == self.iso_a3_dict[country]) | 
-                                              (flows_on_date['dest_iso_a3'] == self.iso_a3_dict[country])]
-                
-        show_arrows = True
-        if 'origin' in arrow_options and 'destiny' in arrow_options:
-            total_received = flows_on_date.groupby('dest_iso_a3')['amount'].sum()
-            total_sent = flows_on_date.groupby('origin_iso_a3')['amount'].sum() * -1
-            total = total_received.add(total_sent, fill_value=0)
-        elif 'origin' in arrow_options:
-            total = flows_on_date.groupby('origin_iso_a3')['amount'].sum() * -1
-        elif 'destiny' in arrow_options:
-            total = flows_on_date.groupby('dest_iso_a3')['amount'].sum()
-        else:
-            total = pd.Series(np.zeros(len(self.geodata)), index=self.geodata['iso_a3'])
-            show_arrows = False
-        min_amt, max_amt = total.min(), total.max()
-
-        self.flows_info = {
-            "flows": flows_on_date,
-            "total": total,
-            "min_amt": min_amt,
-            "max_amt": max_amt,
-            "show_arrows": show_arrows,
-            "gdf_countries": self.geodata,
-            "selected_date": date
-        }
-                
-        return self.flows_info
-    
+        # Sorted by day so the flows of a date range are one contiguous slice
+        flows = _flows_from_merge_data(self.merge_data, self.geodata, self.iso_a3_dict)
+        self.flows = flows.sort_values('Date', kind='stable')
+        # What batches appended later check their flows against
+        self.flow_hashes = np.sort(_flow_hashes(self.flows))
+        self.set_flow_tensor()
+        return self.flows
+
+    def set_flow_tensor(self):
+        self.flow_tensor = _with_iso_positions(_flow_tensor_from_flows(self.flows))
+        return self.flow_tensor
+
     def filter_data_by_date_and_country(self, start_date, end_date, selected_countries):
-        filtered_data = self.data[
-            (self.data['Date'] >= pd.to_datetime(start_date).date()) &
-            (self.data['Date'] <= pd.to_datetime(end_date).date())
-        ]
-        if selected_countries:
-            filtered_data = filtered_data[filtered_data['Country'].isin(selected_countries)]
-        return filtered_data
+        return _filter_by_date_and_country(self.transactions(), start_date, end_date, selected_countries)
+
+    def filter_cube_by_date_and_country(self, start_date, end_date, selected_countries):
+        if self.cube is None:
+            self.set_cube()
+        cube = concat_transactions([self.cube, *(cube for cube, _ in self.appended_cube)])
+        return _filter_by_date_and_country(cube, start_date, end_date, selected_countries)
     
     def filter_by_industry(self):
-        return self.data.groupby(['Industry'])['Amount (USD)'].sum()
+        return self.transactions().groupby(['Industry'], observed=True)['Amount (USD)'].sum()
+
+    def build_snapshot(self):
+        if self.stream_chunk_mb:
+            return self.build_streaming_snapshot()
+        if self.data is None:
+            self.get_data()
+        self.set_folium_data()
+        self.set_arrow_data()
+        self.set_cube()
+        self.set_date_index()
+        meta = read_store_meta()
+        self.version = meta.get('csv_sha256', 'unversioned')[:16]
+        self.row_count = len(self.data)
+        self.csv_size = meta.get('csv_size')
+        return self.snapshot()
+
+    def build_streaming_snapshot(self, csv_path=TRANSACTIONS_CSV):
+        # Out-of-core build_snapshot for files that do not fit in memory: the CSV is read in
+        # chunks of about stream_chunk_mb (with their groupby temporaries) and only what the
+        # callbacks query is kept, the cube, the folium counts and per day origin x destination
+        # totals, compacted whenever they outgrow half a chunk. The arrow map flows go to an
+        # on-disk FlowStore. Neither the full frame nor its per-row merge with the geometries is
+        # ever built. stream_chunk_mb sizes the chunks, it does not bound the peak memory: the
+        # libraries, the geometries, the compacted cube and the indexes come on top, and the
+        # cube grows with the distinct keys of the file.
+        self.load_geodata()
+        chunk_bytes = self.stream_chunk_mb * 1e6
+        chunk_rows = _chunk_rows(csv_path, self.stream_chunk_mb)
+
+        self.data, self.merge_data, self.iso_a3_dict = None, None, {}
+        cube_parts, pair_parts, illegal_parts, parts_size = [], [], [], 0
+        self.folium_counts = None
+        known_flows = (np.array([], dtype=np.uint64), np.array([], dtype='datetime64[us]'))
+        flow_store = create_flow_store()
+        with open(csv_path, 'rb') as f:
+            reader = HashingReader(f)
+            for chunk in iter_transactions_csv(reader, chunk_rows):
+                self._add_iso_codes(chunk)
+                clean_illegal = chunk.loc[chunk['Source of Money'] == 'Illegal', ['Country', 'Reported by Authority', 'Amount (USD)', 'Transaction Type']]
+                counts = _folium_counts(clean_illegal)
+                self.folium_counts = counts if self.folium_counts is None else _add_folium_counts(self.folium_counts, counts)
+
+                flows, known_flows = _drop_known_flows(_stream_flows(chunk, self.iso_a3_dict), known_flows)
+                flow_store = flow_store.append(flows)
+
+                new_parts = [_aggregate_cube(chunk), _aggregate_pairs(flows), _illegal_amounts(clean_illegal)]
+                for parts, part in zip([cube_parts, pair_parts, illegal_parts], new_parts):
+                    parts.append(part)
+                parts_size += sum(part.memory_usage(deep=True).sum() for part in new_parts)
+                if parts_size > chunk_bytes / 2:
+                    cube_parts, pair_parts, illegal_parts = [_compact_cube(cube_parts)], [_compact_pairs(pair_parts)], [_compact_illegal(illegal_parts)]
+                    parts_size = sum(part[0].memory_usage(deep=True).sum() for part in [cube_parts, pair_parts, illegal_parts])
+                self.row_count = chunk.index[-1] + 1
+
+        self.version = reader.hexdigest()[:16]
+        self.csv_size = reader.size
+        self.cube = _compact_cube(cube_parts)
+        self.set_cube_index()
+        self.date_index = _date_index_from_cube(self.cube)
+        self.folium_map = _folium_map(self.folium_counts, _compact_illegal(illegal_parts), self.geodata)
+        self.flows = finish_flow_store(flow_store, self.version)
+        pairs = _pairs_with_iso(_compact_pairs(pair_parts), self.iso_a3_dict)
+        self.flow_tensor = _with_iso_positions(_flow_tensor_from_flows(pairs, pairs['flow_count'].to_numpy()))
+        return self.snapshot()
+
+    def _add_iso_codes(self, rows):
+        # Country -> ISO code in order of appearance, like the one built from the merged frame
+        iso_by_admin = self.geodata.set_index('admin')['iso_a3']
+        new_countries = [country for country in rows['Country'].unique() if country not in self.iso_a3_dict]
+        self.iso_a3_dict = {**self.iso_a3_dict, **{country: iso_by_admin.get(country, np.nan) for country in new_countries}}
+
+    def snapshot(self):
+        return DataSnapshot(
+            version=self.version,
+            row_count=self.row_count,
+            data=self.data,
+            appended_data=self.appended_data,
+            geodata=self.geodata,
+            merge_data=self.merge_data,
+            iso_a3_dict=self.iso_a3_dict,
+            cube_parts=(self.cube, *(cube for cube, _ in self.appended_cube)),
+            cube_indexes=(self.cube_index, *(index for _, index in self.appended_cube)),
+            date_index=self.date_index,
+            flows=(self.flows, *(flows for flows, _ in self.appended_flows)),
+            flow_tensor=self.flow_tensor,
+            folium_map=self.folium_map
+        )
+
+    def append_transactions(self, batch, version):
+        # Folds a batch of new rows (parsed like the CSV) into every derived structure and returns
+        # the new snapshot, at a cost that follows the batch, not the rows loaded before it. The
+        # build's frames are never copied: the batch, its cube and its flows become new parts
+        # (see _append_part), the counts and prefix sums (days x labels) are re-laid with it.
+        # Every attribute is rebound to a new object, the previous snapshot stays valid.
+        streaming = self.data is None
+        batch = batch.set_axis(pd.RangeIndex(self.row_count, self.row_count + len(batch)))
+        if streaming:
+            self._add_iso_codes(batch)
+        else:
+            batch_merge = batch.merge(self.geodata, left_on='Country', right_on='admin', how='left')
+            batch_merge = batch_merge.set_axis(batch.index)
+            self.appended_data = _append_part(self.appended_data, batch, lambda a, b: concat_transactions([a, b]))
+            new_countries = batch_merge[['Country', 'iso_a3']].drop_duplicates().set_index('Country')['iso_a3'].to_dict()
+            self.iso_a3_dict = {**self.iso_a3_dict, **new_countries}
+            # rebuilt from transactions() when asked for again
+            self.data_by_country = None
+
+        # Folium aggregates: the per-country counts and illegal amounts are additive
+        clean_batch = batch[['Country', 'Reported by Authority', 'Source of Money', 'Amount (USD)', 'Transaction Type']]
+        clean_batch_illegal = clean_batch[clean_batch['Source of Money'] == 'Illegal']
+        clean_data_illegal = _compact_illegal([self.folium_map['clean_data_illegal'], _illegal_amounts(clean_batch_illegal)])
+        self.folium_counts = _add_folium_counts(self.folium_counts, _folium_counts(clean_batch_illegal))
+        self.folium_map = _folium_map(self.folium_counts, clean_data_illegal, self.geodata)
+
+        # Rows of the batch cube may repeat keys of the other parts: every consumer sums
+        # 'Amount (USD)' and 'Transaction Count' per group, so they are not merged here. Its
+        # labels go on from the rows before it, like the rows of one concatenated cube.
+        batch_cube = _aggregate_cube(batch)
+        cube_rows = len(self.cube) + sum(len(cube) for cube, _ in self.appended_cube)
+        batch_cube = batch_cube.set_axis(pd.RangeIndex(cube_rows, cube_rows + len(batch_cube)))
+        self.appended_cube = _append_part(self.appended_cube, (batch_cube, build_bitmap_index(batch_cube, cube_index_columns)),
+                                          _merge_cube_parts, size=lambda part: len(part[0]))
+        self.date_index = _merge_prefix_sums(self.date_index, _date_index_from_cube(batch_cube), ['countries', 'industries'])
+
+        # Flows are distinct (origin, destination, amount, day) rows: drop the batch flows already
+        # known, by their hashes in memory, on the batch's days on disk (a streamed CSV is in
+        # date order, so those are the last days). New flows are appended parts in both cases:
+        # the on-disk store is shared by the processes using data/cache and never written again.
+        if streaming:
+            batch_flows = _stream_flows(batch, self.iso_a3_dict)
+            batch_flows = batch_flows.assign(dest_iso_a3=batch_flows['Destination Country'].map(self.iso_a3_dict).astype(object))
+            known_flows = self.flows.read(batch_flows['Date'].min(), batch_flows['Date'].max())
+            repeated = pd.concat([known_flows[flow_key], batch_flows[flow_key]]).duplicated().to_numpy()[len(known_flows):].copy()
+            hashes = _flow_hashes(batch_flows)
+        else:
+            batch_flows = _flows_from_merge_data(batch_merge, self.geodata, self.iso_a3_dict)
+            hashes = _flow_hashes(batch_flows)
+            repeated = _in_sorted(self.flow_hashes, hashes)
+        for _, known_hashes in self.appended_flows:
+            repeated |= _in_sorted(known_hashes, hashes)
+        batch_flows = batch_flows[~repeated].sort_values('Date', kind='stable')
+        if len(batch_flows):
+            self.appended_flows = _append_part(self.appended_flows, (batch_flows, np.sort(hashes[~repeated])),
+                                               _merge_flow_parts, size=lambda part: len(part[0]))
+            tensor = _merge_prefix_sums(self.flow_tensor, _flow_tensor_from_flows(batch_flows), ['iso_a3', 'iso_a3'])
+            self.flow_tensor = _with_iso_positions(tensor)
+
+        self.row_count += len(batch)
+        self.version = version
+        return self.snapshot()
+
+
+# Queries over a snapshot: pure functions of their arguments that return their results,
+# nothing is stored on the snapshot except the memos of some of them. A memoized result is
+# shared by every caller and must not be modified.
+
+def _snapshot_memo(snapshot, cache, key, compute, maxsize=32):
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        with snapshot.memo_lock:
+            if len(cache) >= maxsize:
+                cache.pop(next(iter(cache)))
+            cache[key] = value
+    return value
+
+
+def query_date_range(snapshot, start_date, end_date, selected_countries):
+    # Keyed by the day slice and the known countries selected, so any inputs that filter the
+    # same transactions share one result
+    index = snapshot.date_index
+    lo = np.searchsorted(index['dates'], pd.to_datetime(start_date).normalize().to_datetime64(), side='left')
+    hi = np.searchsorted(index['dates'], pd.to_datetime(end_date).normalize().to_datetime64(), side='right')
+    hi = max(hi, lo)
+    if isinstance(selected_countries, str):
+        selected_countries = [selected_countries]
+    countries = tuple(c for c in index['countries'] if c in selected_countries) if selected_countries else None
+    return _snapshot_memo(snapshot, snapshot.range_cache, ('range', int(lo), int(hi), countries),
+                          lambda: _date_range_totals(index, lo, hi, countries))
+
+
+def _date_range_totals(index, lo, hi, countries):
+    if countries is not None:
+        country_mask = np.isin(index['countries'], countries)
+    else:
+        country_mask = np.ones(len(index['countries']), dtype=bool)
+
+    industry_amounts = (index['amounts'][hi] - index['amounts'][lo])[country_mask].sum(axis=0)
+    industry_counts = (index['counts'][hi] - index['counts'][lo])[country_mask].sum(axis=0)
+
+    # Only industries with transactions in the range, like a groupby over the filtered rows
+    observed = industry_counts > 0
+    industry_totals = pd.DataFrame({
+        'Industry': index['industries'][observed],
+        'Amount (USD)': industry_amounts[observed],
+        'Transaction Count': industry_counts[observed]
+    })
+    return {
+        "total_transactions": int(industry_counts.sum()),
+        "total_amount": float(industry_amounts[observed].sum()),
+        "industry_totals": industry_totals
+    }
+
+
+def select_cube(snapshot, selections):
+    # Cube rows matching {column: values} on every indexed column (see select_rows), from every
+    # part. Without appended parts an unfiltered selection is the build's cube itself.
+    selected = []
+    for cube, index in zip(snapshot.cube_parts, snapshot.cube_indexes):
+        rows = select_rows(index, selections)
+        selected.append(cube if rows is None else cube.take(rows))
+    return selected[0] if len(selected) == 1 else concat_transactions(selected)
+
+
+def cube_frame(snapshot):
+    # The whole cube as one frame, for the builders that group all of it
+    return select_cube(snapshot, {})
+
+
+def cube_values(snapshot, column):
+    # Values of an indexed column in order of first appearance, like unique() over cube_frame
+    values = {}
+    for index in snapshot.cube_indexes:
+        values.update(dict.fromkeys(indexed_values(index, column)))
+    return list(values)
+
+
+def layout_columns(snapshot):
+    # The columns create_layout_v2 reads (the first and last day, the countries and industries),
+    # from the indexes instead of the cube parts
+    return {
+        'Date': pd.Series(snapshot.date_index['dates'][[0, -1]]),
+        'Country': pd.Series(cube_values(snapshot, 'Country')),
+        'Industry': pd.Series(cube_values(snapshot, 'Industry'))
+    }
+
+
+def total_transaction_amount(snapshot):
+    return _snapshot_memo(snapshot, snapshot.range_cache, 'total', lambda: float(snapshot.date_index['amounts'][-1].sum()))
+
+
+def daily_country_series(snapshot, selected_industries):
+    # Per country: its observed days and the cumulative sum of its daily amount over them
+    # (leading 0), for the selected industries. Memoized per industry selection.
+    key = frozenset(selected_industries)
+    return _snapshot_memo(snapshot, snapshot.series_cache, key, lambda: _daily_country_series(snapshot.date_index, key))
+
+
+def _daily_country_series(index, industries):
+    industry_mask = np.isin(index['industries'], list(industries))
+    daily_amounts = np.diff(index['amounts'][:, :, industry_mask].sum(axis=2), axis=0)
+    daily_counts = np.diff(index['counts'][:, :, industry_mask].sum(axis=2), axis=0)
+
+    series = {}
+    for c, country in enumerate(index['countries']):
+        observed = daily_counts[:, c] > 0
+        if observed.any():
+            series[country] = (index['dates'][observed], np.concatenate([[0.0], np.cumsum(daily_amounts[observed, c])]))
+    return series
+
+
+def rolling_amounts(snapshot, selected_industries, country_selected, window_size):
+    # Same as groupby(['Country', 'Date']).sum() then rolling(window_size, min_periods=1).mean()
+    # per country, as one vectorized difference of the cached cumulative sums
+    rolling = {}
+    for country, (dates, cumulative) in daily_country_series(snapshot, selected_industries).items():
+        if country not in country_selected:
+            continue
+        end = np.arange(1, len(dates) + 1)
+        start = np.maximum(end - window_size, 0)
+        rolling[country] = (dates, (cumulative[end] - cumulative[start]) / (end - start))
+    return rolling
+
+
+def filter_flows(snapshot, arrow_options, country, date, end_date=None):
+    tensor = snapshot.flow_tensor
+    start = pd.to_datetime(date).normalize().to_datetime64()
+    end = start if end_date is None else pd.to_datetime(end_date).normalize().to_datetime64()
+    lo = np.searchsorted(tensor['dates'], start, side='left')
+    hi = max(np.searchsorted(tensor['dates'], end, side='right'), lo)
+    flows_on_date = _flows_between(snapshot.flows, tensor, start, end, snapshot.geodata, snapshot.iso_a3_dict)
+
+    # Origin x destination pairs kept by the country and arrow options
+    n = len(tensor['iso_a3'])
+    pair_mask = np.ones((n, n), dtype=bool)
+    if country != 'ALL':
+        iso = snapshot.iso_a3_dict[country]
+        is_origin = np.zeros((n, n), dtype=bool)
+        is_dest = np.zeros((n, n), dtype=bool)
+        if iso in tensor['iso_position']:
+            is_origin[tensor['iso_position'][iso], :] = True
+            is_dest[:, tensor['iso_position'][iso]] = True
+        if 'origin' in arrow_options and 'destiny' not in arrow_options:
+            pair_mask = is_origin
+            flows_on_date = flows_on_date[flows_on_date['origin_iso_a3'] == iso]
+        elif 'destiny' in arrow_options and 'origin' not in arrow_options:
+            pair_mask = is_dest
+            flows_on_date = flows_on_date[flows_on_date['dest_iso_a3'] == iso]
+        else:
+            pair_mask = is_origin | is_dest
+            flows_on_date = flows_on_date[(flows_on_date['origin_iso_a3'] == iso) | 
+                                          (flows_on_date['dest_iso_a3'] == iso)]
+
+    amounts = (tensor['amounts'][hi] - tensor['amounts'][lo]) * pair_mask
+    counts = (tensor['counts'][hi] - tensor['counts'][lo]) * pair_mask
+    received, has_received = amounts.sum(axis=0), counts.sum(axis=0) > 0
+    sent, has_sent = amounts.sum(axis=1), counts.sum(axis=1) > 0
+
+    show_arrows = True
+    if 'origin' in arrow_options and 'destiny' in arrow_options:
+        present = has_received | has_sent
+        total = pd.Series((received - sent)[present], index=tensor['iso_a3'][present])
+    elif 'origin' in arrow_options:
+        total = pd.Series(-sent[has_sent], index=tensor['iso_a3'][has_sent])
+    elif 'destiny' in arrow_options:
+        total = pd.Series(received[has_received], index=tensor['iso_a3'][has_received])
+    else:
+        total = pd.Series(np.zeros(len(snapshot.geodata)), index=snapshot.geodata['iso_a3'])
+        show_arrows = False
+    min_amt, max_amt = total.min(), total.max()
+
+    return {
+        "flows": flows_on_date,
+        "total": total,
+        "min_amt": min_amt,
+        "max_amt": max_amt,
+        "show_arrows": show_arrows,
+        "gdf_countries": snapshot.geodata,
+        "selected_date": date
+    }
+
+
+# Builders shared by the full build and the incremental batch updates
+
+def _aggregate_cube(data):
+    # Sum and count of 'Amount (USD)' per distinct key, so callbacks scan keys instead of rows.
+    # The sum keeps the 'Amount (USD)' name so the figure builders group it like raw rows.
+    cube = data.groupby(cube_dimensions, observed=True)['Amount (USD)'].agg(['sum', 'count']).reset_index()
+    return cube.rename(columns={'sum': 'Amount (USD)', 'count': 'Transaction Count'})
+
+
+def _date_index_from_cube(cube):
+    # Cumulative sums over the sorted days of amount and count per Country x Industry.
+    # Row 0 is all zeros, so a date range [lo, hi) is amounts[hi] - amounts[lo].
+    daily = cube.groupby(['Date', 'Country', 'Industry'], observed=True)[['Amount (USD)', 'Transaction Count']].sum().reset_index()
+    dates = np.sort(daily['Date'].unique())
+    countries = sorted(daily['Country'].unique())
+    industries = sorted(daily['Industry'].unique())
+
+    date_idx = np.searchsorted(dates, daily['Date'].values) + 1
+    country_idx = pd.Index(countries).get_indexer(daily['Country'])
+    industry_idx = pd.Index(industries).get_indexer(daily['Industry'])
+
+    amounts = np.zeros((len(dates) + 1, len(countries), len(industries)), dtype=np.float64)
+    counts = np.zeros((len(dates) + 1, len(countries), len(industries)), dtype=np.int64)
+    amounts[date_idx, country_idx, industry_idx] = daily['Amount (USD)'].values
+    counts[date_idx, country_idx, industry_idx] = daily['Transaction Count'].values
+
+    return {
+        "dates": dates,
+        "countries": np.array(countries, dtype=object),
+        "industries": np.array(industries, dtype=object),
+        "amounts": _read_only(np.cumsum(amounts, axis=0)),
+        "counts": _read_only(np.cumsum(counts, axis=0))
+    }
+
+
+def _flows_from_merge_data(merge_data, geodata, iso_a3_dict):
+    # Obtenemos coordenadas (lat/lon) a partir del punto representativo
+    transaction_info = merge_data[['iso_a3', 'rep_lat', 'rep_lon', 'Destination Country', 'Amount (USD)', 'Date']].drop_duplicates()
+
+    destination_points = geodata.set_index('admin')
+    transaction_info = transaction_info.rename(columns={'rep_lat': 'o_lat', 'rep_lon': 'o_lon'})
+    transaction_info['d_lat'] = transaction_info['Destination Country'].map(destination_points['rep_lat'])
+    transaction_info['d_lon'] = transaction_info['Destination Country'].map(destination_points['rep_lon'])
+
+    # plain strings so flows group in alphabetical ISO order like the origin codes
+    transaction_info['iso_a3_dest'] = transaction_info['Destination Country'].map(iso_a3_dict).astype(object)
+
+    # obtain origin and destination coordinates
+    flows_df = pd.DataFrame(transaction_info)
+    return flows_df.rename(columns={'Amount (USD)': 'amount', 'iso_a3': 'origin_iso_a3', 'iso_a3_dest': 'dest_iso_a3'})
+
+
+def _flow_tensor_from_flows(flows, flow_counts=None):
+    # Dense days x origin x destination amounts and counts, stored as cumulative sums over
+    # the days (row 0 is zeros) so any date range [lo, hi) is tensor[hi] - tensor[lo].
+    # flow_counts weighs rows that already aggregate several flows (streamed ingestion).
+    dates = np.sort(flows['Date'].unique())
+    iso_a3 = np.array(sorted(set(flows['origin_iso_a3']) | set(flows['dest_iso_a3'])), dtype=object)
+
+    date_idx = np.searchsorted(dates, flows['Date'].values) + 1
+    origin_idx = pd.Index(iso_a3).get_indexer(flows['origin_iso_a3'])
+    dest_idx = pd.Index(iso_a3).get_indexer(flows['dest_iso_a3'])
+
+    amounts = np.zeros((len(dates) + 1, len(iso_a3), len(iso_a3)), dtype=np.float64)
+    counts = np.zeros((len(dates) + 1, len(iso_a3), len(iso_a3)), dtype=np.int64)
+    np.add.at(amounts, (date_idx, origin_idx, dest_idx), flows['amount'].values)
+    np.add.at(counts, (date_idx, origin_idx, dest_idx), 1 if flow_counts is None else flow_counts)
+
+    return {
+        "dates": dates,
+        "iso_a3": iso_a3,
+        "amounts": _read_only(np.cumsum(amounts, axis=0)),
+        "counts": _read_only(np.cumsum(counts, axis=0))
+    }
+
+
+def _with_iso_positions(tensor):
+    return {**tensor, "iso_position": {iso: i for i, iso in enumerate(tensor['iso_a3'])}}
+
+
+def _flows_between(flows, tensor, start, end, geodata=None, iso_a3_dict=None):
+    # Flows of the days in [start, end]: a slice of each (date sorted) part of the flows, in
+    # CSV order within a day. The build's part of a streamed snapshot is a read of the on-disk
+    # FlowStore; its flows, and those appended to it, are completed with the columns the
+    # in-memory flows have
+    slices = []
+    for part in flows:
+        if isinstance(part, FlowStore):
+            slices.append(part.read(start, end))
+            continue
+        dates = part['Date'].values
+        slices.append(part.iloc[np.searchsorted(dates, start, side='left'):np.searchsorted(dates, end, side='right')])
+    appended = [part_flows for part_flows in slices[1:] if len(part_flows)]
+    if not isinstance(flows[0], FlowStore):
+        if not appended:
+            return slices[0]
+        return concat_transactions([slices[0], *appended]).sort_values('Date', kind='stable')
+
+    flows = pd.concat([slices[0], *appended]).sort_values('Date', kind='stable') if appended else slices[0]
+    if geodata is not None:
+        flows['dest_iso_a3'] = flows['Destination Country'].map(iso_a3_dict).astype(object)
+        origin_points = geodata.set_index('iso_a3')
+        destination_points = geodata.set_index('admin')
+        flows['o_lat'] = flows['origin_iso_a3'].map(origin_points['rep_lat'])
+        flows['o_lon'] = flows['origin_iso_a3'].map(origin_points['rep_lon'])
+        flows['d_lat'] = flows['Destination Country'].map(destination_points['rep_lat'])
+        flows['d_lon'] = flows['Destination Country'].map(destination_points['rep_lon'])
+    return flows
+
+
+def _append_part(parts, part, merge, size=len):
+    # Appended parts are merged while the one before the last is at most twice its size: there
+    # are O(log n) parts and an appended row is copied O(log n) times, however large the
+    # build's frames (kept out of the parts, never copied) are
+    parts = [*parts, part]
+    while len(parts) > 1 and size(parts[-2]) <= 2 * size(parts[-1]):
+        parts[-2:] = [merge(parts[-2], parts[-1])]
+    return tuple(parts)
+
+
+def _merge_cube_parts(a, b):
+    cube = concat_transactions([a[0], b[0]])
+    return cube, append_bitmap_index(a[1], b[0])
+
+
+def _merge_flow_parts(a, b):
+    # Both date sorted: a stable sort keeps a's flows of a day before b's, in CSV order
+    flows = concat_transactions([a[0], b[0]]).sort_values('Date', kind='stable')
+    return flows, np.sort(np.concatenate([a[1], b[1]]))
+
+
+def _flow_hashes(flows):
+    return pd.util.hash_pandas_object(flows[flow_key], index=False).to_numpy()
+
+
+def _in_sorted(sorted_hashes, hashes):
+    if len(sorted_hashes) == 0:
+        return np.zeros(len(hashes), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_hashes, hashes), len(sorted_hashes) - 1)
+    return sorted_hashes[positions] == hashes
+
+
+def _merge_prefix_sums(index, other, label_keys):
+    # Sum of two prefix-sum indexes laid out over the union of their days and labels: costs
+    # days x labels, whatever the number of rows behind either of them
+    dates = np.union1d(index['dates'], other['dates'])
+    labels = {key: np.array(sorted(set(index[key]) | set(other[key])), dtype=object) for key in label_keys}
+    merged = {"dates": dates, **labels}
+    for name in ['amounts', 'counts']:
+        total = np.zeros((len(dates) + 1, *(len(labels[key]) for key in label_keys)), dtype=index[name].dtype)
+        for part in [index, other]:
+            # prefix sum of the part at each union day = its row for the days up to that one
+            rows = np.concatenate([[0], np.searchsorted(part['dates'], dates, side='right')])
+            positions = [pd.Index(labels[key]).get_indexer(part[key]) for key in label_keys]
+            total[np.ix_(np.arange(len(rows)), *positions)] += part[name][rows]
+        merged[name] = _read_only(total)
+    return merged
+
+
+def _chunk_rows(csv_path, stream_chunk_mb):
+    # Rows per chunk so that a parsed chunk plus the temporaries of its groupbys (about four
+    # copies of it) take about stream_chunk_mb, estimated from the first rows
+    chunks = iter_transactions_csv(csv_path, 1000)
+    sample = next(chunks)
+    chunks.close()
+    bytes_per_row = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    return max(1000, int(stream_chunk_mb * 1e6 / (4 * bytes_per_row)))
+
+
+def _stream_flows(rows, iso_a3_dict):
+    # The distinct flows of a chunk of rows, keyed like _flows_from_merge_data but without the
+    # geometries: coordinates are added when the flows of a day are read back
+    flows = pd.DataFrame({
+        'origin_iso_a3': rows['Country'].map(iso_a3_dict).astype(object),
+        'Destination Country': rows['Destination Country'],
+        'amount': rows['Amount (USD)'],
+        'Date': rows['Date']
+    })
+    return flows.drop_duplicates()
+
+
+def _drop_known_flows(flows, known_flows):
+    # Drops the flows already seen in an earlier chunk on the same day. Hashes are kept for the
+    # days of the last chunk only, which is exact for a CSV in date order (a day spans
+    # consecutive chunks) and bounds the memory of the check by the chunk size.
+    known_hashes, known_days = known_flows
+    hashes = pd.util.hash_pandas_object(flows, index=False).to_numpy()
+    new = ~np.isin(hashes, known_hashes)
+    flows = flows[new]
+    days = flows['Date'].to_numpy()
+    still_open = np.isin(known_days, np.unique(days))
+    return flows, (np.concatenate([known_hashes[still_open], hashes[new]]), np.concatenate([known_days[still_open], days]))
+
+
+def _aggregate_pairs(flows):
+    pairs = flows.groupby(['Date', 'origin_iso_a3', 'Destination Country'], observed=True)['amount'].agg(['sum', 'count'])
+    return pairs.rename(columns={'sum': 'amount', 'count': 'flow_count'}).reset_index()
+
+
+def _compact_pairs(parts):
+    pairs = concat_transactions(parts)
+    return pairs.groupby(['Date', 'origin_iso_a3', 'Destination Country'], observed=True)[['amount', 'flow_count']].sum().reset_index()
+
+
+def _pairs_with_iso(pairs, iso_a3_dict):
+    return pairs.assign(dest_iso_a3=pairs['Destination Country'].map(iso_a3_dict).astype(object))
+
+
+def _compact_cube(parts):
+    cube = concat_transactions(parts)
+    return cube.groupby(cube_dimensions, observed=True)[['Amount (USD)', 'Transaction Count']].sum().reset_index()
+
+
+def _illegal_amounts(clean_data_illegal):
+    # Illegal amount per country: all the folium map reads from the illegal rows
+    return clean_data_illegal.groupby('Country', observed=True)['Amount (USD)'].sum().reset_index()
+
+
+def _compact_illegal(parts):
+    return _illegal_amounts(concat_transactions(parts))
+
+
+def _folium_counts(clean_data_illegal):
+    by_country = clean_data_illegal.groupby('Country', observed=True)
+    return {
+        "reported": by_country['Reported by Authority'].sum(),
+        "illegal": by_country.size(),
+        "transaction_types": clean_data_illegal.groupby(['Country', 'Transaction Type'], observed=True).size().unstack(fill_value=0)
+    }
+
+
+def _add_folium_counts(counts, other):
+    return {key: counts[key].add(other[key], fill_value=0).fillna(0).astype(np.int64).sort_index() for key in counts}
+
+
+def _folium_map(folium_counts, clean_data_illegal, geodata):
+    map_illegal_data = {}
+    map_transactions_data = {}
+    for country, illegal_total in folium_counts['illegal'].items():
+        illegal_count = folium_counts['reported'][country]
+        map_illegal_data[country] = illegal_count / illegal_total if illegal_total > 0 else 0
+
+        # Same order as value_counts: most frequent first, ties in category order
+        transaction_counts = folium_counts['transaction_types'].loc[country]
+        transaction_counts = transaction_counts[transaction_counts > 0].sort_values(ascending=False, kind='stable')
+        map_transactions_data[country] = transaction_counts.to_dict()
+
+    return {
+        "map_illegal_data": map_illegal_data,
+        "map_transactions_data": map_transactions_data,
+        "clean_data_illegal": clean_data_illegal,
+        "geo_data": geodata
+    }
+
+
+def _read_only(array):
+    # Built once in the (preloading) gunicorn master and shared copy-on-write by the workers:
+    # an accidental in-place write would raise instead of silently copying the pages
+    array.flags.writeable = False
+    return array
+
+
+def _filter_by_date_and_country(dataset, start_date, end_date, selected_countries):
+    filtered_data = dataset[
+        (dataset['Date'] >= pd.to_datetime(start_date).normalize()) &
+        (dataset['Date'] <= pd.to_datetime(end_date).normalize())
+    ]
+    if selected_countries:
+        filtered_data = filtered_data[filtered_data['Country'].isin(selected_countries)]
+    return filtered_data
@@ -0,0 +1,97 @@
+import io
+import os
+import time
+import hashlib
+import logging
+import threading
+
+from functions.transaction_store import TRANSACTIONS_CSV, parse_transactions_csv
+
+# Hot reload of data/transactions.csv, which only grows by appended batches: a background
+# thread tails the file, parses just the new lines, folds them into the DataManager
+# (DataManager.append_transactions) and hands the resulting snapshot to a callback that
+# swaps it in. A CSV that was rewritten instead of appended to triggers a full rebuild.
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionsTail:
+    # Reads the lines appended since the last call. Only whole lines are consumed: a batch
+    # still being written is picked up, complete, by a later call.
+    def __init__(self, csv_path=TRANSACTIONS_CSV, offset=None):
+        self.csv_path = csv_path
+        with open(csv_path, 'rb') as f:
+            self.header = f.readline()
+        self.offset = os.path.getsize(csv_path) if offset is None else offset
+        self.fingerprint = self._fingerprint()
+
+    def _fingerprint(self):
+        # Last bytes before the offset, to tell an appended file from a rewritten one
+        with open(self.csv_path, 'rb') as f:
+            f.seek(max(self.offset - 4096, 0))
+            return hashlib.sha1(f.read(min(self.offset, 4096))).hexdigest()
+
+    def read(self):
+        # Returns (rewritten, new complete lines)
+        size = os.path.getsize(self.csv_path)
+        if size < self.offset or self._fingerprint() != self.fingerprint:
+            return True, b''
+        if size == self.offset:
+            return False, b''
+        with open(self.csv_path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(size - self.offset)
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+        if chunk:
+            self.offset += len(chunk)
+            self.fingerprint = self._fingerprint()
+        return False, chunk
+
+
+class DataWatcher:
+    def __init__(self, manager, on_snapshot, csv_path=TRANSACTIONS_CSV, interval=10.0):
+        self.manager = manager
+        self.on_snapshot = on_snapshot
+        self.csv_path = csv_path
+        self.interval = interval
+        # The manager's snapshot holds the first csv_size bytes, anything after them is new
+        self.tail = TransactionsTail(csv_path, manager.csv_size)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def poll(self):
+        start = time.perf_counter()
+        rewritten, chunk = self.tail.read()
+        if rewritten:
+            manager = type(self.manager)(stream_chunk_mb=self.manager.stream_chunk_mb)
+            snapshot = manager.build_snapshot()
+            self.manager = manager
+            self.tail = TransactionsTail(self.csv_path, manager.csv_size)
+            logger.info("transactions CSV rewritten, full rebuild in %.2fs", time.perf_counter() - start)
+        elif chunk:
+            batch = parse_transactions_csv(io.BytesIO(self.tail.header + chunk))
+            # Chained on the previous version, so workers reading the same batches agree on it
+            version = hashlib.sha1(self.manager.version.encode('utf-8') + chunk).hexdigest()[:16]
+            snapshot = self.manager.append_transactions(batch, version)
+            logger.info("%d new transactions loaded in %.3fs", len(batch), time.perf_counter() - start)
+        else:
+            return None
+        self.on_snapshot(snapshot)
+        return snapshot
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("transactions reload failed, keeping the current snapshot")
+
+    def ensure_started(self):
+        # Threads do not survive gunicorn's fork: each worker starts its own, on its first request
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self.run, daemon=True).start()
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+# Downsampling of the line series sent to the browser: Largest-Triangle-Three-Buckets
+# (Steinarsson, 2013) keeps the first and last points and, from each of n_out - 2 equal buckets
+# of the points in between, the one forming the largest triangle with the point kept from the
+# previous bucket and the mean of the next bucket. A line through the kept points follows the
+# shape of the full series (peaks included) with at most n_out points, about one per pixel.
+
+DEFAULT_MAX_POINTS = 1000
+# Point caps are rounded up to this step, so similar screen widths share cached figures
+MAX_POINTS_STEP = 256
+# Buckets up to this size are scanned in python rather than with numpy
+SMALL_BUCKET = 32
+
+
+def max_points_for_width(width_px):
+    if not width_px:
+        return DEFAULT_MAX_POINTS
+    return max(-(-int(width_px) // MAX_POINTS_STEP) * MAX_POINTS_STEP, MAX_POINTS_STEP)
+
+
+def lttb_indices(x, y, n_out):
+    # Positions of the points kept, ascending (all of them when there are no more than n_out)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = _as_float(x)
+    y = np.asarray(y, dtype=float)
+
+    # Bucket i holds the points [edges[i], edges[i + 1]); the first and last points are kept apart
+    edges = (np.arange(n_out - 1) * (n - 2) // (n_out - 2)) + 1
+    counts = np.diff(edges)
+    # Mean of every bucket, then the last point as the one after the last bucket
+    mean_x = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts, y[-1])
+
+    # Each bucket depends on the point kept from the previous one: a loop over the buckets,
+    # with plain floats for the small ones (numpy calls cost more than a few points)
+    xs, ys, edge_list = x.tolist(), y.tolist(), edges.tolist()
+    mean_xs, mean_ys = mean_x.tolist(), mean_y.tolist()
+    kept = [0] * n_out
+    kept[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edge_list[i], edge_list[i + 1]
+        ax, ay, mx, my = xs[a], ys[a], mean_xs[i + 1], mean_ys[i + 1]
+        # Twice the triangle areas (a, point, next bucket mean); the first largest wins
+        if hi - lo <= SMALL_BUCKET:
+            best_area = -1.0
+            for j in range(lo, hi):
+                area = abs((ax - mx) * (ys[j] - ay) - (ax - xs[j]) * (my - ay))
+                if area > best_area:
+                    best_area, a = area, j
+        else:
+            a = lo + int(np.argmax(np.abs((ax - mx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (my - ay))))
+        kept[i + 1] = a
+    return np.array(kept, dtype=np.int64)
+
+
+def downsample_series(series, n_out, x_range=None):
+    # {name: (x, y)} with x ascending -> the same with at most n_out points each. With x_range
+    # (lo, hi) only the points inside it are downsampled, plus the nearest one outside on each
+    # side so the lines reach the edges of the view.
+    downsampled = {}
+    for name, (x, y) in series.items():
+        x, y = np.asarray(x), np.asarray(y)
+        lo, hi = _range_bounds(x, x_range)
+        x, y = x[lo:hi], y[lo:hi]
+        kept = lttb_indices(x, y, n_out)
+        downsampled[name] = (x[kept], y[kept])
+    return downsampled
+
+
+def keeps_every_point(series, n_out, x_range=None):
+    # Whether downsample_series(series, n_out, x_range) keeps all the points in range: its x
+    # then depends on the dates and x_range only, not on the y values
+    if n_out < 3:
+        return True
+    for x, _ in series.values():
+        lo, hi = _range_bounds(np.asarray(x), x_range)
+        if hi - lo > n_out:
+            return False
+    return True
+
+
+def _range_bounds(x, x_range):
+    if x_range is None:
+        return 0, len(x)
+    lo = max(np.searchsorted(x, x_range[0], side='left') - 1, 0)
+    hi = min(np.searchsorted(x, x_range[1], side='right') + 1, len(x))
+    return lo, hi
+
+
+def relayout_x_range(relayout_data, axis='xaxis'):
+    # What a plotly relayout event did to `axis`: (False, None) if nothing, else (True, range)
+    # with range [lo, hi] after a zoom or pan, None after an autorange (double click)
+    relayout_data = relayout_data or {}
+    if f'{axis}.range[0]' in relayout_data and f'{axis}.range[1]' in relayout_data:
+        return True, [relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']]
+    if f'{axis}.range' in relayout_data:
+        return True, list(relayout_data[f'{axis}.range'])
+    if relayout_data.get(f'{axis}.autorange'):
+        return True, None
+    return False, None
+
+
+def date_range(x_range):
+    # A relayout range of a date axis ('2013-01-05 10:30:00.123' strings) as datetime64 bounds
+    if x_range is None:
+        return None
+    return tuple(pd.Timestamp(value).to_datetime64() for value in x_range)
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if x.dtype.kind == 'M':
+        return x.astype('datetime64[ns]').astype(np.int64).astype(float)
+    return x.astype(float)
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+# Bounded LRU cache for the figures returned by the dashboard callbacks, keyed on a
+# canonical hash of the callback inputs. Each worker keeps an in-memory LRU; when a
+# directory is configured the figures are also written there as JSON so that every
+# gunicorn worker on the host can reuse them.
+
+
+def canonical_key(name, args, kwargs):
+    # Multi-select values are sets for our callbacks, so list order must not change the key
+    def canonical(value):
+        # Data snapshots stand for their version, not their contents
+        if hasattr(value, 'version'):
+            return f"{type(value).__name__}@{value.version}"
+        if isinstance(value, (list, tuple)):
+            return sorted((canonical(v) for v in value), key=repr)
+        if isinstance(value, dict):
+            return {k: canonical(v) for k, v in sorted(value.items())}
+        return value
+
+    payload = json.dumps([name, canonical(list(args)), canonical(kwargs)], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class FigureCache:
+    def __init__(self, maxsize=128, ttl=600, directory=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # memoized function name -> {'hit': n, 'miss': n}
+        self.function_stats = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            maxsize=int(os.environ.get('FIGURE_CACHE_SIZE', 128)),
+            ttl=float(os.environ.get('FIGURE_CACHE_TTL', 600)),
+            directory=os.environ.get('FIGURE_CACHE_DIR') or None
+        )
+
+    def _expired(self, created):
+        return bool(self.ttl) and time.time() - created > self.ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, figure = entry
+            if self._expired(created):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return figure
+
+    def _set_memory(self, key, figure, created=None):
+        with self._lock:
+            self._entries[key] = (created or time.time(), figure)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _get_disk(self, key):
+        path = self._path(key)
+        try:
+            created = os.path.getmtime(path)
+            if self._expired(created):
+                os.remove(path)
+                return None, None
+            with open(path) as f:
+                return created, json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None, None
+
+    def _set_disk(self, key, figure):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(pio.to_json(figure, validate=False))
+        os.replace(tmp_path, path)
+
+        # Bound the shared directory, dropping the least recently written figures
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')]
+        if len(files) > self.maxsize:
+            files.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+            for old_path in files[:len(files) - self.maxsize]:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+    def get(self, key):
+        figure = self._get_memory(key)
+        if figure is None and self.directory:
+            created, figure = self._get_disk(key)
+            if figure is not None:
+                self._set_memory(key, figure, created)
+        return figure
+
+    def set(self, key, figure):
+        self._set_memory(key, figure)
+        if self.directory:
+            self._set_disk(key, figure)
+
+    def memoize(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = canonical_key(func.__name__, args, kwargs)
+            figure = self.get(key)
+            with self._lock:
+                if figure is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                counts = self.function_stats.setdefault(func.__name__, {'hit': 0, 'miss': 0})
+                counts['hit' if figure is not None else 'miss'] += 1
+            if figure is not None:
+                return figure
+            figure = func(*args, **kwargs)
+            self.set(key, figure)
+            return figure
+        return wrapper
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl
+        }
@@ -0,0 +1,100 @@
+import os
+import glob
+import fcntl
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Flows of a streamed ingestion (see DataManager.build_streaming_snapshot), kept on disk as
+# Parquet parts instead of in memory: the arrow map only needs the flows of one day, read
+# back with a filter on the Date column. Parts are only written while a store is built under
+# its temporary name; the flows of rows appended later stay in memory as parts of the snapshot
+# (see DataManager.append_transactions), a finished store is never written again.
+# A finished store is named after its data version and shared by every process using
+# data/cache. Each process reading it holds a shared flock on its lease file (forked workers
+# inherit the preloaded one), and a store is only deleted once nobody holds its lease.
+
+FLOW_STORE_DIR = 'data/cache'
+flow_columns = ['row', 'origin_iso_a3', 'Destination Country', 'amount', 'Date']
+
+
+class FlowStore:
+    def __init__(self, directory, parts=(), lease=None):
+        self.directory = directory
+        self.parts = tuple(parts)
+        # open lease file, released when the last store of this process holding it is dropped
+        self.lease = lease
+
+    def append(self, flows):
+        # flows: frame with the flow_columns except 'row', which is taken from the index
+        # (the row of the transaction in the CSV, also used to order and jitter the flows)
+        if len(flows) == 0:
+            return self
+        # pyarrow's dataset / parquet writers are only loaded by streamed ingestions
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            'row': flows.index.to_numpy(dtype=np.int64),
+            'origin_iso_a3': flows['origin_iso_a3'].astype(str).to_numpy(),
+            'Destination Country': flows['Destination Country'].astype(str).to_numpy(),
+            'amount': flows['amount'].to_numpy(dtype=np.float64),
+            'Date': flows['Date'].to_numpy()
+        })
+        path = os.path.join(self.directory, f"part-{flows.index[0]:012d}.parquet")
+        pq.write_table(table, path)
+        return FlowStore(self.directory, self.parts + (path,), self.lease)
+
+    def read(self, start, end, columns=None):
+        # Flows of the days in [start, end], in CSV order within a day like the in-memory flows
+        if not self.parts:
+            return pd.DataFrame(columns=flow_columns[1:])
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(list(self.parts), format='parquet')
+        date_filter = (ds.field('Date') >= pa.scalar(np.datetime64(start, 'us'))) & (ds.field('Date') <= pa.scalar(np.datetime64(end, 'us')))
+        columns = None if columns is None else ['row', 'Date'] + [c for c in columns if c not in ('row', 'Date')]
+        flows = dataset.to_table(columns=columns, filter=date_filter).to_pandas()
+        flows = flows.sort_values(['Date', 'row'], kind='stable').set_index('row')
+        flows.index.name = None
+        return flows
+
+
+def create_flow_store(directory=FLOW_STORE_DIR):
+    path = os.path.join(directory, f"flow_store_{os.getpid()}.tmp")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return FlowStore(path)
+
+
+def finish_flow_store(flow_store, version, directory=FLOW_STORE_DIR):
+    # Gives a store built under its temporary name the name of the data version it holds,
+    # leased by this process, and drops the stores of other versions nobody leases. A store of
+    # the same version holds the same flows, so if another process got there first its files
+    # are used, with its own parts (cut at other rows when its chunk size differs).
+    # Finishing and dropping run under one lock, so a store is never leased while deleted.
+    path = os.path.join(directory, f"flow_store_{version}")
+    with open(os.path.join(directory, 'flow_store.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isdir(path):
+            shutil.rmtree(flow_store.directory, ignore_errors=True)
+        else:
+            os.replace(flow_store.directory, path)
+        lease = open(os.path.join(path, 'lease'), 'a')
+        fcntl.flock(lease, fcntl.LOCK_SH)
+        parts = sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+        for old_path in glob.glob(os.path.join(directory, 'flow_store_*')):
+            if old_path != path and not old_path.endswith('.tmp'):
+                _remove_unleased(old_path)
+    return FlowStore(path, parts, lease)
+
+
+def _remove_unleased(path):
+    with open(os.path.join(path, 'lease'), 'a') as lease:
+        try:
+            fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import glob
+import gzip
+import fcntl
+import base64
+import shutil
+import hashlib
+import threading
+from urllib.parse import quote
+
+from flask import Response, abort, request
+
+from functions.geo_store import countries_feature_collection
+from functions.graph import make_info_folium_map, render_folium_popups
+
+# Pre-rendered folium map: the map document, its country geometries and its matplotlib
+# popups are built once, offline (popups rendered on a process pool, one per CPU) or by a
+# background job at startup (popups rendered in its thread), into a versioned directory
+# keyed by a hash of the data they show. A Flask route serves those files as separately
+# cacheable, immutable assets.
+
+FOLIUM_STORE_DIR = 'data/cache'
+FOLIUM_ARTIFACT_VERSION = 3
+FOLIUM_ROUTE = '/folium'
+
+# Background builds started in this process; a preloading gunicorn master waits for them
+# before forking so no worker inherits a half-held build lock
+build_threads = []
+
+content_types = {
+    '.html': 'text/html; charset=utf-8',
+    '.geojson': 'application/geo+json',
+    '.png': 'image/png'
+}
+
+
+def folium_data_hash(folium_map_info):
+    illegal_amounts = folium_map_info['clean_data_illegal'].groupby('Country', observed=True)['Amount (USD)'].sum()
+    geo_data = folium_map_info['geo_data']
+    payload = json.dumps({
+        'version': FOLIUM_ARTIFACT_VERSION,
+        'map_illegal_data': folium_map_info['map_illegal_data'],
+        'map_transactions_data': folium_map_info['map_transactions_data'],
+        'illegal_amounts': illegal_amounts.round(2).to_dict(),
+        'geometry': hashlib.sha1(json.dumps(geo_data['geometry'].tolist()).encode('utf-8')).hexdigest(),
+        'admin': geo_data['admin'].tolist()
+    }, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def folium_artifact_dir(data_hash, directory=FOLIUM_STORE_DIR):
+    return os.path.join(directory, f"folium_map_v{FOLIUM_ARTIFACT_VERSION}_{data_hash}")
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def build_folium_artifact(folium_map_info, directory=FOLIUM_STORE_DIR, processes=1):
+    data_hash = folium_data_hash(folium_map_info)
+    artifact_dir = folium_artifact_dir(data_hash, directory)
+    tmp_dir = f"{artifact_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    geo_data = folium_map_info['geo_data']
+    countries = set(geo_data['admin'])
+    popup_images = render_folium_popups(folium_map_info['map_illegal_data'], folium_map_info['map_transactions_data'],
+                                        countries=countries, processes=processes)
+
+    # Relative URLs, resolved against the map document's own versioned path
+    popup_urls = {}
+    for kind, images in popup_images.items():
+        popup_urls[kind] = {}
+        for country, img_base64 in images.items():
+            _write(os.path.join(tmp_dir, 'popups', kind, f"{country}.png"), base64.b64decode(img_base64))
+            popup_urls[kind][country] = f"popups/{kind}/{quote(country)}.png"
+
+    # Same FeatureCollection the choropleth is built from, so its style ids match
+    geojson = json.dumps(countries_feature_collection(geo_data))
+    html = make_info_folium_map(**folium_map_info, popup_urls=popup_urls, geojson_url='countries.geojson')
+
+    for name, content in [('map.html', html), ('countries.geojson', geojson)]:
+        _write(os.path.join(tmp_dir, name), content.encode('utf-8'))
+        _write(os.path.join(tmp_dir, f"{name}.gz"), gzip.compress(content.encode('utf-8'), compresslevel=9))
+
+    shutil.rmtree(artifact_dir, ignore_errors=True)
+    os.replace(tmp_dir, artifact_dir)
+
+    # Artifacts built from older data are no longer served
+    for old_dir in glob.glob(os.path.join(directory, 'folium_map_v*')):
+        if old_dir == artifact_dir or old_dir.endswith('.tmp'):
+            continue
+        if os.path.isdir(old_dir):
+            shutil.rmtree(old_dir, ignore_errors=True)
+        else:
+            os.remove(old_dir)
+    return artifact_dir
+
+
+def ensure_folium_artifact(folium_map_info, directory=FOLIUM_STORE_DIR, processes=1):
+    artifact_dir = folium_artifact_dir(folium_data_hash(folium_map_info), directory)
+    if os.path.isdir(artifact_dir):
+        return artifact_dir
+    # Only one process builds, the others wait for it and reuse the files
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'folium_map.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.isdir(artifact_dir):
+            build_folium_artifact(folium_map_info, directory, processes)
+    return artifact_dir
+
+
+def start_folium_artifact_build(folium_map_info, directory=FOLIUM_STORE_DIR, processes=1):
+    thread = threading.Thread(target=ensure_folium_artifact, args=(folium_map_info, directory, processes), daemon=True)
+    thread.start()
+    build_threads.append(thread)
+    return thread
+
+
+def wait_for_folium_artifact_builds():
+    for thread in build_threads:
+        thread.join()
+
+
+def register_folium_routes(server, get_folium_map_info, directory=FOLIUM_STORE_DIR):
+    # Serves /folium/<hash>/<asset>; the hash is part of the URL so every asset is immutable.
+    # get_folium_map_info returns the map data currently shown, which changes when new
+    # transactions are loaded. Returns a function giving the URL of the current map.
+    current = {}
+
+    def current_map():
+        folium_map_info = get_folium_map_info()
+        entry = current.get('entry')
+        if entry is None or entry[1] is not folium_map_info:
+            entry = (folium_data_hash(folium_map_info), folium_map_info)
+            current['entry'] = entry
+        return entry
+
+    @server.route(f"{FOLIUM_ROUTE}/<data_hash_requested>/<path:asset>")
+    def folium_asset(data_hash_requested, asset):
+        data_hash, folium_map_info = current_map()
+        if data_hash_requested == data_hash:
+            artifact_dir = ensure_folium_artifact(folium_map_info, directory)
+        else:
+            # a page loaded before the data changed, served for as long as its files exist
+            artifact_dir = folium_artifact_dir(data_hash_requested, directory)
+            if not re.fullmatch('[0-9a-f]{16}', data_hash_requested) or not os.path.isdir(artifact_dir):
+                abort(404)
+        path = os.path.normpath(os.path.join(artifact_dir, asset))
+        extension = os.path.splitext(path)[1]
+        if not path.startswith(artifact_dir + os.sep) or extension not in content_types or not os.path.isfile(path):
+            abort(404)
+
+        etag = f"{data_hash_requested}-{hashlib.sha1(asset.encode('utf-8')).hexdigest()[:12]}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            use_gzip = os.path.exists(path + '.gz') and 'gzip' in request.headers.get('Accept-Encoding', '')
+            with open(path + '.gz' if use_gzip else path, 'rb') as f:
+                response = Response(f.read(), content_type=content_types[extension])
+            if use_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    def folium_map_url():
+        return f"{FOLIUM_ROUTE}/{current_map()[0]}/map.html"
+
+    return folium_map_url
+
+
+if __name__ == '__main__':
+    from functions.data_processing import DataManager
+
+    data_manager = DataManager()
+    data_manager.get_data()
+    path = ensure_folium_artifact(data_manager.set_folium_data(), processes=os.cpu_count() or 1)
+    print(f"Folium map written to {path}")
@@ -0,0 +1,93 @@
+import os
+import json
+import pandas as pd
+
+# Local geometry store: the country polygons used by the dashboard plus their
+# representative points and centroids, built once from the files in data/ so
+# that no worker needs network access (osmnx / Nominatim) to start.
+# geopandas / shapely are only needed to build it: the store is loaded as a plain
+# DataFrame whose geometry column holds the GeoJSON geometries.
+
+WORLD_GEOJSON = 'data/custom.geo.json'
+SELECTED_GEOJSON = 'data/selected_countries.geojson'
+SINGAPORE_GEOJSON = 'data/singapore.geojson'
+GEO_STORE_PATH = 'data/cache/geodata.geojson'
+
+mapping_countries = {
+    'Brazil': 'Brazil',
+    'China': 'China',
+    'India': 'India',
+    'Russia': 'Russia',
+    'Singapore': 'Singapore',
+    'South Africa': 'South Africa',
+    'Switzerland': 'Switzerland',
+    'United Arab Emirates': 'UAE',
+    'United Kingdom': 'UK',
+    'United States of America': 'USA'}
+
+
+def _source_files():
+    return [f for f in [WORLD_GEOJSON, SELECTED_GEOJSON, SINGAPORE_GEOJSON] if os.path.exists(f)]
+
+
+def is_store_fresh(path=GEO_STORE_PATH):
+    if not os.path.exists(path):
+        return False
+    store_mtime = os.path.getmtime(path)
+    return all(os.path.getmtime(f) <= store_mtime for f in _source_files())
+
+
+def build_geo_store(path=GEO_STORE_PATH):
+    import geopandas as gpd
+    import shapely
+
+    # selected_countries.geojson already holds the subset of custom.geo.json we need
+    if os.path.exists(SELECTED_GEOJSON):
+        world = gpd.read_file(SELECTED_GEOJSON)
+    else:
+        world = gpd.read_file(WORLD_GEOJSON)
+    gdf_countries = world[world['admin'].isin(mapping_countries.keys())][['admin', 'iso_a3', 'geometry']]
+
+    # Singapore is not in the Natural Earth files, a simplified outline is bundled
+    singapore = gpd.read_file(SINGAPORE_GEOJSON)[['admin', 'iso_a3', 'geometry']]
+    gdf_countries = gpd.GeoDataFrame(pd.concat([gdf_countries, singapore], ignore_index=True),
+                                     geometry='geometry', crs="EPSG:4326")
+    gdf_countries['admin'] = gdf_countries['admin'].map(mapping_countries)
+
+    rep_points = shapely.point_on_surface(gdf_countries.geometry.values)
+    centroids = shapely.centroid(gdf_countries.geometry.values)
+    gdf_countries['rep_lon'] = shapely.get_x(rep_points)
+    gdf_countries['rep_lat'] = shapely.get_y(rep_points)
+    gdf_countries['centroid_lon'] = shapely.get_x(centroids)
+    gdf_countries['centroid_lat'] = shapely.get_y(centroids)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    gdf_countries.to_file(tmp_path, driver='GeoJSON')
+    os.replace(tmp_path, path)
+    return gdf_countries
+
+
+def load_geo_store(path=GEO_STORE_PATH):
+    if not is_store_fresh(path):
+        build_geo_store(path)
+    with open(path) as f:
+        features = json.load(f)['features']
+    gdf_countries = pd.DataFrame([feature['properties'] for feature in features])
+    gdf_countries['geometry'] = [feature['geometry'] for feature in features]
+    return gdf_countries
+
+
+def countries_feature_collection(gdf_countries):
+    # Same features (ids, admin property, geometry) folium builds from a GeoDataFrame of
+    # admin + geometry, so the choropleth styles the countries by the same ids
+    return {
+        'type': 'FeatureCollection',
+        'features': [{'id': str(i), 'type': 'Feature', 'properties': {'admin': admin}, 'geometry': geometry}
+                     for i, admin, geometry in zip(gdf_countries.index, gdf_countries['admin'], gdf_countries['geometry'])]
+    }
+
+
+if __name__ == '__main__':
+    gdf = build_geo_store()
+    print(f"Geometry store with {len(gdf)} countries written to {GEO_STORE_PATH}")
@@ -1,16 +1,19 @@
 import plotly.graph_objects as go
-import random
-from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
-import folium
 import io
 import base64
-import matplotlib
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dash import html
 import dash_bootstrap_components as dbc
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+
+from functions.geo_store import countries_feature_collection
+from functions.serialization import figure_to_dict
+
+# matplotlib (popups) and folium (folium map) are imported by the functions that use them:
+# they only run when the folium artifact is built, a worker serving the dashboard never loads them
 
 #create a dict to map each coutry to a color
 country_color = {
@@ -74,7 +77,7 @@ def get_color(amount, min_amt, max_amt):
     return colorscale[idx][1]
 
 def make_cards_for_industries(filtered_data):
-    industry_counts = filtered_data.groupby('Industry')['Amount (USD)'].sum()
+    industry_counts = filtered_data.groupby('Industry', observed=True)['Amount (USD)'].sum()
     industry_elements = list(industry_counts.items())
     industry_elements_ordered = sorted(industry_elements, key=lambda x: x[1])
 
@@ -143,136 +146,166 @@ def make_cards_for_industries(filtered_data):
 
 # Folium map with pie charts and bar charts as popups on country centroids
 
-def make_info_folium_map(clean_data_illegal, geo_data, map_illegal_data, map_transactions_data):
+@functools.cache
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def _figure_to_base64(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')  # guarda como PNG in-memory
+    _pyplot().close(fig)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+def render_illegal_ratio_png(country, ratio):
+    fig, ax = _pyplot().subplots(figsize=(2, 2), dpi=150)
+    ax.pie([ratio, 1 - ratio], colors=[colorscale[int(ratio * (len(colorscale) - 1))][1], "#FF6A6A"], startangle=90)
+    ax.axis('equal')
+    ax.set_title(f"{country}\nIllegal Ratio: {ratio:.2%}", fontsize=8)
+    return _figure_to_base64(fig)
+
+def render_transaction_types_png(country, transaction_counts):
+    fig, ax = _pyplot().subplots(figsize=(2, 2), dpi=150)
+    ax.bar(transaction_counts.keys(), transaction_counts.values(), color=[color_transaction_type.get(txn_type, "#FFFFFF") for txn_type in transaction_counts.keys()])
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+    ax.set_title(f"Transactions in {country}", fontsize=8)
+    ax.set_xticks(range(len(transaction_counts)))
+    ax.set_xticklabels(transaction_counts.keys(), rotation=45, fontsize=8)
+    return _figure_to_base64(fig)
+
+def render_folium_popups(map_illegal_data, map_transactions_data, countries=None, processes=1):
+    # PNG (base64) popups for every country, rendered in this process unless processes > 1.
+    # Only the offline build (python -m functions.folium_store) uses a pool: its spawned
+    # children re-import __main__, which for the dashboard would re-run all its module setup
+    countries = [c for c in map_illegal_data if countries is None or c in countries]
+    jobs = [(render_illegal_ratio_png, ('illegal', c), (c, map_illegal_data[c])) for c in countries]
+    jobs += [(render_transaction_types_png, ('transactions', c), (c, map_transactions_data[c])) for c in countries]
+
+    popup_images = {'illegal': {}, 'transactions': {}}
+    if min(processes, len(jobs)) <= 1:
+        for func, (kind, country), args in jobs:
+            popup_images[kind][country] = func(*args)
+        return popup_images
+
+    with ProcessPoolExecutor(max_workers=min(processes, len(jobs)), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {(kind, country): pool.submit(func, *args) for func, (kind, country), args in jobs}
+        for (kind, country), future in futures.items():
+            popup_images[kind][country] = future.result()
+    return popup_images
+
+def _image_popup(img_base64=None, img_url=None):
+    import folium
+
+    if img_url is not None:
+        # Served image: the popup lives in the map document so the relative URL resolves
+        html = f"""
+        <div style="text-align:center; width:150px;">
+            <img src="{img_url}" style="max-width:100%; height:auto;" />
+        </div>
+        """
+        return folium.Popup(html, max_width=300)
+    html = f"""
+        <div style="text-align:center;">
+            <img src="data:image/png;base64,{img_base64}" style="max-width:100%; height:auto;" />
+        </div>
+        """
+    iframe_popup = folium.IFrame(html=html, width=150, height=170)
+    return folium.Popup(iframe_popup, max_width=300)
+
+def make_info_folium_map(clean_data_illegal, geo_data, map_illegal_data, map_transactions_data, popup_images=None, processes=1,
+                         popup_urls=None, geojson_url=None):
+    # popup_urls / geojson_url make the map reference its popups and country geometries by URL
+    # instead of embedding them, so they can be served and cached as separate assets
+    import folium
 
     map = folium.Map(location=[20, 0], zoom_start=2)
 
     # Choropleth layer for total illegal amount by country
 
-    folium.Choropleth(
-        geo_data=geo_data[['admin', 'geometry']],
+    choropleth = folium.Choropleth(
+        geo_data=countries_feature_collection(geo_data),
         name='choropleth',
-        data=clean_data_illegal.groupby('Country')['Amount (USD)'].sum() / 1e6,
+        data=clean_data_illegal.groupby('Country', observed=True)['Amount (USD)'].sum() / 1e6,
         columns=['admin', 'Illegal Ratio'],
         key_on='feature.properties.admin',
         fill_color='YlOrRd',
         fill_opacity=0.7,
         line_opacity=0.2,
         legend_name='Total Illegal Amount (Millions USD)',
-    ).add_to(map)
-
-    # Centroid markers with pie charts of illegal vs legal transactions
-
-    fg_markers = folium.FeatureGroup(name="centroid_markers_illegal")
-    for country, ratio in map_illegal_data.items():
-        geometry = geo_data[geo_data['admin'] == country].geometry
-        if geometry.empty:
-            continue
-        centroid = geometry.values[0].centroid
-
-        fig, ax = plt.subplots(figsize=(2, 2), dpi=150)
-        ax.pie([ratio, 1 - ratio], colors=[colorscale[int(ratio * (len(colorscale) - 1))][1], "#FF6A6A"], startangle=90)
-        ax.axis('equal')
-        ax.set_title(f"{country}\nIllegal Ratio: {ratio:.2%}", fontsize=8)
-
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', bbox_inches='tight')  # guarda como PNG in-memory
-        plt.close(fig)
-        img_base64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-
-        html = f"""
-        <div style="text-align:center;">
-            <img src="data:image/png;base64,{img_base64}" style="max-width:100%; height:auto;" />
-        </div>
-        """
-        iframe_popup = folium.IFrame(html=html, width=150, height=170)
-        popup = folium.Popup(iframe_popup, max_width=300)
-
-        folium.Marker(
-            location=[centroid.y, centroid.x],
-            radius=5 + ratio * 20,
-            popup=popup,
-            color='blue',
-            
-        ).add_to(fg_markers)
-
-    fg_markers.add_to(map)
-
-    # Centroid markers with bar charts of transaction types
-
-    fg_markers = folium.FeatureGroup(name="centroid_markers_transactions")
-    for country, ratio in map_illegal_data.items():
-        geometry = geo_data[geo_data['admin'] == country].geometry
-        if geometry.empty:
-            continue
-        centroid = geometry.values[0].centroid
-
-        fig, ax = plt.subplots(figsize=(2, 2), dpi=150)
-        ax.bar(map_transactions_data[country].keys(), map_transactions_data[country].values(), color=[color_transaction_type.get(txn_type, "#FFFFFF") for txn_type in map_transactions_data[country].keys()])
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        ax.set_title(f"Transactions in {country}", fontsize=8)
-        ax.set_xticklabels(map_transactions_data[country].keys(), rotation=45, fontsize=8)
-
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', bbox_inches='tight')  # guarda como PNG in-memory
-        plt.close(fig)
-        img_base64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-
-        html = f"""
-        <div style="text-align:center;">
-            <img src="data:image/png;base64,{img_base64}" style="max-width:100%; height:auto;" />
-        </div>
-        """
-        iframe_popup = folium.IFrame(html=html, width=150, height=170)
-        popup = folium.Popup(iframe_popup, max_width=300)
-
-        folium.Marker(
-            location=[centroid.y, centroid.x],
-            radius=5 + ratio * 20,
-            popup=popup,
-            color='blue',
-            
-        ).add_to(fg_markers)
-
-    fg_markers.add_to(map)
+    )
+    if geojson_url is not None:
+        choropleth.geojson.embed = False
+        choropleth.geojson.embed_link = geojson_url
+    choropleth.add_to(map)
+
+    if popup_images is None and popup_urls is None:
+        popup_images = render_folium_popups(map_illegal_data, map_transactions_data,
+                                            countries=set(geo_data['admin']), processes=processes)
+
+    # Centroid markers with pie charts of illegal vs legal transactions (illegal)
+    # and bar charts of transaction types (transactions)
+
+    for kind in ['illegal', 'transactions']:
+        fg_markers = folium.FeatureGroup(name=f"centroid_markers_{kind}")
+        for country, ratio in map_illegal_data.items():
+            country_geo = geo_data[geo_data['admin'] == country]
+            if country_geo.empty:
+                continue
+
+            if popup_urls is not None:
+                popup = _image_popup(img_url=popup_urls[kind][country])
+            else:
+                popup = _image_popup(img_base64=popup_images[kind][country])
+
+            folium.Marker(
+                location=[country_geo['centroid_lat'].values[0], country_geo['centroid_lon'].values[0]],
+                radius=5 + ratio * 20,
+                popup=popup,
+                color='blue',
+                
+            ).add_to(fg_markers)
+
+        fg_markers.add_to(map)
     
     folium.LayerControl().add_to(map)
 
+    if popup_urls is not None:
+        # Served as a standalone document instead of the notebook iframe wrapper
+        return map.get_root().render()
     return map._repr_html_()
 
 # Map with arrows showing transactions between countries
 
-def make_transaction_arrow_map(flows, gdf_countries, selected_date, total, min_amt, max_amt, show_arrows):
-
-    fig = go.Figure()
-    # Color each country based on the total amount received
-    amount_colors = {}
-    for iso, amt in total.items():
-        amount_colors[iso] = get_color(amt, min_amt, max_amt)
-
-    # Add choropleth layer for countries
-    fig.add_trace(go.Choropleth(
-        locations=list(amount_colors.keys()),
-        z=list(total.values),
-        text=[admin for admin in gdf_countries.set_index('iso_a3').loc[list(amount_colors.keys()), 'admin']],
-        colorscale=[c[1] for c in colorscale],
-        autocolorscale=True,
-        marker_line_color='white',
-        colorbar_title="Flow Amount (USD)",
-        hoverinfo='text',
-        hovertemplate='%{text}<br>Flow Amount: %{z:.2f} (USD)<extra></extra>',
-        geo='geo',
-        showscale=True
-    ))
-
-    # Add arrows for flows
+def flow_jitter(flows, spread=1.5, seed='transactionsmap0'):
+    # Deterministic offsets per flow, hashed from its row label: a flow keeps its position
+    # across dates and filters, and cached figures are reproducible (seed is a 16 char hash key)
+    hashes = pd.util.hash_array(flows.index.to_numpy(), hash_key=seed)
+    unit_lon = (hashes & 0xFFFFFFFF) / 0xFFFFFFFF
+    unit_lat = (hashes >> np.uint64(32)) / 0xFFFFFFFF
+    return (unit_lon * 2 - 1) * spread, (unit_lat * 2 - 1) * spread
+
+def _arrow_hover_text(flows, iso_admin, sign):
+    return np.array([
+        f"Origen: {origin} ({iso_admin[origin]})<br>"
+        f"Destino: {dest} ({iso_admin[dest]})<br>"
+        f"Flujo: {sign}{amount/1e6:03f} Millions (USD)"
+        for origin, dest, amount in zip(flows['origin_iso_a3'], flows['dest_iso_a3'], flows['amount'])
+    ], dtype=object)
+
+def make_arrow_traces(flows, iso_admin):
+    # One trace per flow (legacy rendering, only reasonable for a handful of flows)
+    text_origin = _arrow_hover_text(flows, iso_admin, '-')
+    text_dest = _arrow_hover_text(flows, iso_admin, '+')
+    jitter_lon, jitter_lat = flow_jitter(flows)
     traces = []
-    for _, r in flows.iterrows():
+    for (_, r), t_origin, t_dest, j_lon, j_lat in zip(flows.iterrows(), text_origin, text_dest, jitter_lon, jitter_lat):
         traces.append(go.Scattergeo(
-            lon=[r['o_lon'], r['d_lon'] + random.uniform(-1.5, 1.5)],
-            lat=[r['o_lat'], r['d_lat'] + random.uniform(-1.5, 1.5)],
+            lon=[r['o_lon'], r['d_lon'] + j_lon],
+            lat=[r['o_lat'], r['d_lat'] + j_lat],
             mode='lines+markers',
             line=dict(width=1 + r['amount'] / 1000000, color=country_color.get(r['origin_iso_a3'], 'black')),
             marker=dict(
@@ -283,26 +316,85 @@ def make_transaction_arrow_map(flows, gdf_countries, selected_date, total, min_a
             ),
             opacity=0.7,
             hoverinfo='text',
-            text=[
-            f"Origen: {r['origin_iso_a3']} ({gdf_countries.set_index('iso_a3').loc[r['origin_iso_a3'], 'admin']})<br>"
-            f"Destino: {r['dest_iso_a3']} ({gdf_countries.set_index('iso_a3').loc[r['dest_iso_a3'], 'admin']})<br>"
-            f"Flujo: -{r['amount']/1e6:03f} Millions (USD)",
-            f"Origen: {r['origin_iso_a3']} ({gdf_countries.set_index('iso_a3').loc[r['origin_iso_a3'], 'admin']})<br>"
-            f"Destino: {r['dest_iso_a3']} ({gdf_countries.set_index('iso_a3').loc[r['dest_iso_a3'], 'admin']})<br>"
-            f"Flujo: +{r['amount']/1e6:03f} Millions (USD)"
-            ],
+            text=[t_origin, t_dest],
             showlegend=False
         ))
+    return traces
+
+def make_vectorized_arrow_traces(flows, iso_admin):
+    # Flows grouped by origin colour and line width (plotly only has one line width per trace).
+    # Each trace holds many segments [origin, destination, gap]; arrow sizes are per-point arrays.
+    n = len(flows)
+    if n == 0:
+        return []
+    amount = flows['amount'].to_numpy(dtype=float)
+    o_lon, o_lat = flows['o_lon'].to_numpy(dtype=float), flows['o_lat'].to_numpy(dtype=float)
+    jitter_lon, jitter_lat = flow_jitter(flows)
+    d_lon = flows['d_lon'].to_numpy(dtype=float) + jitter_lon
+    d_lat = flows['d_lat'].to_numpy(dtype=float) + jitter_lat
+    width = np.round(1 + amount / 1000000)
+    text_origin = _arrow_hover_text(flows, iso_admin, '-')
+    text_dest = _arrow_hover_text(flows, iso_admin, '+')
+
+    groups = pd.DataFrame({'origin': flows['origin_iso_a3'].to_numpy(), 'width': width}).groupby(['origin', 'width']).indices
 
-    if show_arrows:
-        for trace in traces:
-            fig.add_trace(trace)
+    traces = []
+    for (origin, line_width), rows in groups.items():
+        color = country_color.get(origin, 'black')
+        k = len(rows)
+        # Interleave origin / destination / gap (NaN breaks the line) for every flow of the group
+        lon = np.full(3 * k, np.nan)
+        lat = np.full(3 * k, np.nan)
+        lon[0::3], lon[1::3] = o_lon[rows], d_lon[rows]
+        lat[0::3], lat[1::3] = o_lat[rows], d_lat[rows]
+        # Zero-sized marker at the origin, arrow head at the destination
+        size = np.zeros(3 * k)
+        size[1::3] = 8 + amount[rows] / 500000
+        text = np.empty(3 * k, dtype=object)
+        text[0::3], text[1::3] = text_origin[rows], text_dest[rows]
+        traces.append(go.Scattergeo(
+            lon=lon,
+            lat=lat,
+            mode='lines+markers',
+            line=dict(width=line_width, color=color),
+            marker=dict(size=size, symbol='triangle-up', color=color, line=dict(width=0)),
+            opacity=0.7,
+            hoverinfo='text',
+            text=text,
+            showlegend=False
+        ))
+    return traces
+
+# The arrow map is a static base figure (geo layout, legend and choropleth styling) plus what
+# the date and filters change (arrow_map_updates): the choropleth arrays, the arrow traces, the
+# legend visibility and the title. The dashboard sends the base once and then patches these.
+# Trace order: the choropleth, one legend trace per country colour, then the arrows.
+
+ARROW_TRACES_START = 1 + len(country_color)
+
+def make_arrow_map_base(gdf_countries):
+    fig = go.Figure()
+    iso_admin = gdf_countries.set_index('iso_a3')['admin'].to_dict()
+
+    # Choropleth layer for countries, its locations and z come with the updates
+    fig.add_trace(go.Choropleth(
+        locations=[],
+        z=[],
+        text=[],
+        colorscale=[c[1] for c in colorscale],
+        autocolorscale=True,
+        marker_line_color='white',
+        colorbar_title="Flow Amount (USD)",
+        hoverinfo='text',
+        hovertemplate='%{text}<br>Flow Amount: %{z:.2f} (USD)<extra></extra>',
+        geo='geo',
+        showscale=True
+    ))
 
     # Add legend for countries colors
-    legend_traces = []
     for iso, color in country_color.items():
-        admin_name = gdf_countries.set_index('iso_a3').loc[iso, 'admin'] if iso in gdf_countries['iso_a3'].values else iso
-        legend_traces.append(go.Scattergeo(
+        admin_name = iso_admin.get(iso, iso)
+        fig.add_trace(go.Scattergeo(
             lon=[None], lat=[None],  # invisible points
             mode='markers',
             marker=dict(size=12, color=color),
@@ -311,10 +403,6 @@ def make_transaction_arrow_map(flows, gdf_countries, selected_date, total, min_a
             showlegend=True
         ))
 
-    if show_arrows:
-        for trace in legend_traces:
-            fig.add_trace(trace)
-
     fig.update_layout(
         legend=dict(
             orientation="v",
@@ -342,12 +430,107 @@ def make_transaction_arrow_map(flows, gdf_countries, selected_date, total, min_a
     )
     fig.update_layout(
         margin=dict(l=0, r=0, t=0, b=0),
-        hovermode='closest',
-        title=f"Transacciones del {selected_date}"
+        hovermode='closest'
     )
-    return fig, flows
+    return fig
+
+def arrow_map_updates(flows, gdf_countries, selected_date, total, min_amt, max_amt, show_arrows, vectorized=True):
+    # Plain JSON-able values, so they can be cached and sent as a Patch
+    iso_admin = gdf_countries.set_index('iso_a3')['admin'].to_dict()
+    # Color each country based on the total amount received
+    amount_colors = {}
+    for iso, amt in total.items():
+        amount_colors[iso] = get_color(amt, min_amt, max_amt)
+
+    arrows = []
+    if show_arrows:
+        traces = make_vectorized_arrow_traces(flows, iso_admin) if vectorized else make_arrow_traces(flows, iso_admin)
+        # Figure serialization: numpy arrays become compact base64 typed arrays
+        arrows = figure_to_dict(go.Figure(traces))['data']
+    return {
+        'choropleth': {
+            'locations': list(amount_colors.keys()),
+            'z': list(total.values),
+            'text': [iso_admin[iso] for iso in amount_colors.keys()]
+        },
+        'legend_visible': bool(show_arrows),
+        'arrows': arrows,
+        'title': f"Transacciones del {selected_date}"
+    }
+
+def apply_arrow_map_updates(base, updates):
+    # The whole figure, as a dict: the base (a figure or its dict) with the updates applied.
+    # Nothing is validated again and neither argument is modified.
+    base = figure_to_dict(base) if isinstance(base, go.Figure) else base
+    data = [dict(trace) for trace in base['data']]
+    data[0].update(updates['choropleth'])
+    for trace in data[1:]:
+        trace['visible'] = updates['legend_visible']
+    return {'data': data + updates['arrows'], 'layout': dict(base['layout'], title={'text': updates['title']})}
+
+def make_transaction_arrow_map(flows, gdf_countries, selected_date, total, min_amt, max_amt, show_arrows, vectorized=True):
+    updates = arrow_map_updates(flows, gdf_countries, selected_date, total, min_amt, max_amt, show_arrows, vectorized)
+    return go.Figure(apply_arrow_map_updates(make_arrow_map_base(gdf_countries), updates)), flows
 
 # Stacked Bar Charts with legal vs illegal transactions by industry and country
+# dataset is the pre-aggregated cube (DataManager.set_cube), counts come from 'Transaction Count'.
+# The dashboard draws this chart in the browser (assets/industry_bar_chart.js): the server sends
+# make_stacked_illegal_legal_base and stacked_illegal_legal_data once, and the script fills the
+# base traces for the selected country and normalization like make_stacked_illegal_legal does.
+
+def make_stacked_illegal_legal_base():
+    # Subplots: bar chart (count) + bar chart (amount), traces without values:
+    # illegal count, legal count, illegal amount, legal amount
+    from plotly.subplots import make_subplots
+    fig = make_subplots(
+        rows=1, cols=2, subplot_titles=['Transaction Count', 'Amount (Millions USD)'],
+        shared_yaxes=False
+    )
+    for col in (1, 2):
+        # The legend only shows the count traces
+        fig.add_trace(go.Bar(
+            name='Illegal',
+            marker_color="#FF4747",
+            legendgroup='group1',
+            showlegend=col == 1,
+            textposition='auto',
+            hoverinfo='text'
+        ), row=1, col=col)
+        fig.add_trace(go.Bar(
+            name='Legal',
+            marker_color='#77DD77',
+            legendgroup='group2',
+            showlegend=col == 1,
+            textposition='auto',
+            hoverinfo='text'
+        ), row=1, col=col)
+
+    fig.update_layout(
+        title='Transaction Overview by Industry',
+        template='plotly_white',
+        legend_title_text='Source of Money',
+        barmode='stack'
+    )
+
+    fig.update_xaxes(title_text='Industry', row=1, col=1)
+    fig.update_yaxes(title_text='Count', row=1, col=1)
+    fig.update_xaxes(title_text='Industry', row=1, col=2)
+    fig.update_yaxes(title_text='Amount (Millions USD)', row=1, col=2)
+    return fig
+
+def stacked_illegal_legal_data(dataset):
+    # {country: {source: {'industries', 'counts', 'amounts' (millions USD)}}} for every country,
+    # summed like make_stacked_illegal_legal sums them for one
+    dataset = dataset.assign(**{'Amount (USD)': dataset['Amount (USD)'] / 1e6})
+    totals = dataset.groupby(['Country', 'Source of Money', 'Industry'], observed=True)[['Transaction Count', 'Amount (USD)']].sum()
+    data = {}
+    for (country, source), rows in totals.groupby(level=[0, 1], observed=True):
+        data.setdefault(country, {})[source] = {
+            'industries': rows.index.get_level_values('Industry').tolist(),
+            'counts': rows['Transaction Count'].tolist(),
+            'amounts': rows['Amount (USD)'].tolist()
+        }
+    return data
 
 def make_stacked_illegal_legal(selected_country, normalize_clicks, dataset):
     filtered_data = dataset[dataset['Country'] == selected_country]
@@ -356,24 +539,20 @@ def make_stacked_illegal_legal(selected_country, normalize_clicks, dataset):
     legal_data = filtered_data[filtered_data['Source of Money'] == 'Legal']
 
     # Agrupa por industria
-    industry_group_illegal = illegal_data.groupby('Industry')
-    industry_group_legal = legal_data.groupby('Industry')
+    industry_group_illegal = illegal_data.groupby('Industry', observed=True)
+    industry_group_legal = legal_data.groupby('Industry', observed=True)
     
     #illegal data
-    illegal_counts = industry_group_illegal.size().reset_index(name='Illegal Transaction Count')
+    illegal_counts = industry_group_illegal['Transaction Count'].sum().reset_index(name='Illegal Transaction Count')
     illegal_amounts = industry_group_illegal['Amount (USD)'].sum().reset_index(name='Illegal Amount (USD)')
     illegal_amounts['Illegal Amount (Millions USD)'] = illegal_amounts['Illegal Amount (USD)']
 
     # legal_data
-    legal_counts = industry_group_legal.size().reset_index(name='Legal Transaction Count')
+    legal_counts = industry_group_legal['Transaction Count'].sum().reset_index(name='Legal Transaction Count')
     legal_amounts = industry_group_legal['Amount (USD)'].sum().reset_index(name='Legal Amount (USD)')
     legal_amounts['Legal Amount (Millions USD)'] = legal_amounts['Legal Amount (USD)']
 
-    # Subplots: bar chart (count) + bar chart (amount)
-    fig = make_subplots(
-        rows=1, cols=2, subplot_titles=['Transaction Count', 'Amount (Millions USD)'],
-        shared_yaxes=False
-    )
+    fig = make_stacked_illegal_legal_base()
 
     suffix = ""
     if normalize_clicks % 2 == 1:
@@ -391,81 +570,75 @@ def make_stacked_illegal_legal(selected_country, normalize_clicks, dataset):
         illegal_amounts['Illegal Amount (Millions USD)'] = illegal_amounts['Illegal Amount (USD)'] / total_amounts
         legal_amounts['Legal Amount (Millions USD)'] = legal_amounts['Legal Amount (USD)'] / total_amounts
 
-    # Add traces for count subplot
-    fig.add_trace(go.Bar(
+    # Fill the traces of the count subplot
+    fig.data[0].update(
         x=illegal_counts['Industry'],
         y=illegal_counts['Illegal Transaction Count'],
         name=f'Illegal{suffix}',
-        marker_color="#FF4747",
-        legendgroup='group1',
-        showlegend=True,
         texttemplate='%{y:.2%}' if normalize_clicks % 2 == 1 else '%{y}',
-        textposition='auto',
-        hovertext=illegal_counts['Illegal Transaction Count'].apply(lambda x: f'Illegal Transactions: {x:.2%}' if normalize_clicks % 2 == 1 else f'Illegal Transactions: {x}'),
-        hoverinfo='text'
-    ), row=1, col=1)
+        hovertext=illegal_counts['Illegal Transaction Count'].apply(lambda x: f'Illegal Transactions: {x:.2%}' if normalize_clicks % 2 == 1 else f'Illegal Transactions: {x}')
+    )
 
-    fig.add_trace(go.Bar(
+    fig.data[1].update(
         x=legal_counts['Industry'],
         y=legal_counts['Legal Transaction Count'],
         name=f'Legal{suffix}',
-        marker_color='#77DD77',
-        legendgroup='group2',
-        showlegend=True,
         texttemplate='%{y:.2%}' if normalize_clicks % 2 == 1 else '%{y}',
-        textposition='auto',
-        hovertext=legal_counts['Legal Transaction Count'].apply(lambda x: f'Legal Transactions: {x:.2%}' if normalize_clicks % 2 == 1 else f'Legal Transactions: {x}'),
-        hoverinfo='text'
-    ), row=1, col=1)
+        hovertext=legal_counts['Legal Transaction Count'].apply(lambda x: f'Legal Transactions: {x:.2%}' if normalize_clicks % 2 == 1 else f'Legal Transactions: {x}')
+    )
 
-    # Add traces for amount subplot, but don't show legend again
-    fig.add_trace(go.Bar(
+    # and of the amount subplot
+    fig.data[2].update(
         x=illegal_amounts['Industry'],
         y=illegal_amounts['Illegal Amount (Millions USD)'],
         name=f'Illegal{suffix}',
-        marker_color="#FF4747",
-        legendgroup='group1',
-        showlegend=False,
         texttemplate='%{y:.2%}' if normalize_clicks % 2 == 1 else '%{y:.2f}',
-        textposition='auto',
-        hovertext=illegal_amounts['Illegal Amount (Millions USD)'].apply(lambda x: f'Illegal Amount: {x:.2%}' if normalize_clicks % 2 == 1 else f'Illegal Amount: {x:.2f}'),
-        hoverinfo='text'
-    ), row=1, col=2)
+        hovertext=illegal_amounts['Illegal Amount (Millions USD)'].apply(lambda x: f'Illegal Amount: {x:.2%}' if normalize_clicks % 2 == 1 else f'Illegal Amount: {x:.2f}')
+    )
 
-    fig.add_trace(go.Bar(
+    fig.data[3].update(
         x=legal_amounts['Industry'],
         y=legal_amounts['Legal Amount (Millions USD)'],
         name=f'Legal{suffix}',
-        marker_color='#77DD77',
-        legendgroup='group2',
-        showlegend=False,
         texttemplate='%{y:.2%}' if normalize_clicks % 2 == 1 else '%{y:.2f}',
-        textposition='auto',
-        hovertext=legal_amounts['Legal Amount (Millions USD)'].apply(lambda x: f'Legal Amount: {x:.2%}' if normalize_clicks % 2 == 1 else f'Legal Amount: {x:.2f}'),
-        hoverinfo='text'
-    ), row=1, col=2)
-
-    fig.update_layout(
-        title='Transaction Overview by Industry',
-        template='plotly_white',
-        legend_title_text='Source of Money',
-        barmode='stack'
+        hovertext=legal_amounts['Legal Amount (Millions USD)'].apply(lambda x: f'Legal Amount: {x:.2%}' if normalize_clicks % 2 == 1 else f'Legal Amount: {x:.2f}')
     )
 
-    fig.update_xaxes(title_text='Industry', row=1, col=1)
-    fig.update_yaxes(title_text='Count', row=1, col=1)
-    fig.update_xaxes(title_text='Industry', row=1, col=2)
-    fig.update_yaxes(title_text='Amount (Millions USD)', row=1, col=2)
-
     return fig
 
 
 # Line chart of transaction amount over time by country and stacked bar chart of total of transactions by industry. Each stack is a destination country
 
-def make_transaction_over_time(dataset, iso_a3_dict, selected_industries, country_selected, window_size, selected_date):
-    filtered_data = dataset[dataset['Industry'].isin(selected_industries) & (dataset['Country'].isin(country_selected))]
-    transactions_over_time = filtered_data.groupby(['Country', 'Date'])['Amount (USD)'].sum().reset_index()
+# Panels with more points than the threshold are drawn with WebGL (go.Scattergl, same
+# attributes): SVG keeps one DOM node per marker and redraws them all on every hover, pan or zoom
+# frame, but WebGL takes a context of its own and hovers differently. None, the default, keeps
+# SVG whatever the size: a threshold is set per deployment from the browser timings of
+# functions.render_benchmark on its screens and data.
+WEBGL_POINT_THRESHOLD = None
 
+def scatter_trace(points, webgl_threshold=WEBGL_POINT_THRESHOLD):
+    return go.Scattergl if webgl_threshold is not None and points > webgl_threshold else go.Scatter
+
+
+def make_transaction_over_time(dataset, iso_a3_dict, selected_industries, country_selected, window_size, selected_date, rolling_series=None,
+                               webgl_threshold=WEBGL_POINT_THRESHOLD, preselected=False):
+    # rolling_series ({country: (dates, rolling mean)}, see DataManager.rolling_amounts) skips
+    # recomputing the rolling lines from the dataset; preselected: the dataset only holds the
+    # selected industries and countries already (select_cube), it is not filtered again
+    if preselected:
+        filtered_data = dataset
+    else:
+        filtered_data = dataset[dataset['Industry'].isin(selected_industries) & (dataset['Country'].isin(country_selected))]
+    if rolling_series is None:
+        transactions_over_time = filtered_data.groupby(['Country', 'Date'], observed=True)['Amount (USD)'].sum().reset_index()
+        rolling_series = {}
+        for country in transactions_over_time['Country'].unique():
+            country_data = transactions_over_time[transactions_over_time['Country'] == country]
+            # Add a windowed average to smooth the line
+            country_data = country_data.sort_values('Date')
+            rolling_series[country] = (country_data['Date'], country_data['Amount (USD)'].rolling(window=window_size, min_periods=1).mean())
+
+    from plotly.subplots import make_subplots
     fig = make_subplots(
         rows=2, cols=2,
         specs=[[{"colspan": 2}, None], [{}, {}]],
@@ -478,14 +651,11 @@ def make_transaction_over_time(dataset, iso_a3_dict, selected_industries, countr
     )
 
     # Fig 1: Transaction amount over time by country
-    for country in transactions_over_time['Country'].unique():
-        country_data = transactions_over_time[transactions_over_time['Country'] == country]
-        # Add a windowed average to smooth the line
-        country_data = country_data.sort_values('Date')
-        country_data['Amount (USD)'] = country_data['Amount (USD)'].rolling(window=window_size, min_periods=1).mean()
-        fig.add_trace(go.Scatter(
-            x=country_data['Date'],
-            y=country_data['Amount (USD)'],
+    line_trace = scatter_trace(sum(len(dates) for dates, _ in rolling_series.values()), webgl_threshold)
+    for country, (dates, amounts) in rolling_series.items():
+        fig.add_trace(line_trace(
+            x=dates,
+            y=amounts,
             mode='lines+markers',
             name=country,
             line=dict(color=country_color.get(iso_a3_dict.get(country, ''), 'black')),
@@ -499,7 +669,7 @@ def make_transaction_over_time(dataset, iso_a3_dict, selected_industries, countr
     fig.update_layout(barmode='stack', title="Total Transactions by Industry and Destination Country")
 
     # Fig 2: Total of transactions by industry. Stack bar plot, each stack is a destination country
-    industry_totals = filtered_data.groupby(['Country', 'Destination Country'])['Amount (USD)'].sum().reset_index()
+    industry_totals = filtered_data.groupby(['Country', 'Destination Country'], observed=True)['Amount (USD)'].sum().reset_index()
     for des_country in industry_totals['Destination Country'].unique():
         des_country_data = industry_totals[industry_totals['Destination Country'] == des_country]
         fig.add_trace(go.Bar(
@@ -516,11 +686,12 @@ def make_transaction_over_time(dataset, iso_a3_dict, selected_industries, countr
     fig.update_layout(barmode='stack')
 
     # Fig 3: Scatter plot where x is spend transactions and y is received transactions
-    filtered_by_date = filtered_data[filtered_data['Date'] == selected_date]
-    send = filtered_by_date.groupby('Country')['Amount (USD)'].sum().reset_index(name='Spend Amount (USD)')
-    receive = filtered_by_date.groupby('Destination Country')['Amount (USD)'].sum().reset_index(name='Receive Amount (USD)')
+    filtered_by_date = filtered_data[filtered_data['Date'] == pd.Timestamp(selected_date)]
+    send = filtered_by_date.groupby('Country', observed=True)['Amount (USD)'].sum().reset_index(name='Spend Amount (USD)')
+    receive = filtered_by_date.groupby('Destination Country', observed=True)['Amount (USD)'].sum().reset_index(name='Receive Amount (USD)')
 
-    scatter_data = pd.merge(send, receive, left_on='Country', right_on='Destination Country', how='outer').fillna(0)
+    scatter_data = pd.merge(send, receive, left_on='Country', right_on='Destination Country', how='outer')
+    scatter_data = scatter_data.fillna({'Spend Amount (USD)': 0, 'Receive Amount (USD)': 0})
 
     countries = filtered_data['Country'].unique().tolist() + filtered_data['Destination Country'].unique().tolist()
     countries = list(set(countries))  # Remove duplicates
@@ -541,9 +712,10 @@ def make_transaction_over_time(dataset, iso_a3_dict, selected_industries, countr
 
     scatter_size = 10 + (scatter_data['Spend Amount (USD)'] + scatter_data['Receive Amount (USD)']) / 1e6  # Size based on total amount in millions
 
+    marker_trace = scatter_trace(len(scatter_data), webgl_threshold)
     for country in scatter_data['Country'].unique():
         scatter_data_country = scatter_data[scatter_data['Country'] == country]
-        fig.add_trace(go.Scatter(
+        fig.add_trace(marker_trace(
             x=scatter_data_country['Spend Amount (USD)'] / 1e6,  # Convert to millions
             y=scatter_data_country['Receive Amount (USD)'] / 1e6,  # Convert to millions
             mode='markers+text',
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+# Cold start check: imports the dashboard in a fresh interpreter (python -X importtime), then
+# answers every server callback once, and fails when the imports take longer than the budget or
+# when a module only the offline builds need got loaded: the geometry store (geopandas) and
+# the folium artifact (folium, matplotlib). Run it where the stores and the folium
+# artifact are built, like the docker image does after building them:
+#   python -m functions.import_budget
+
+IMPORT_BUDGET_SECONDS = float(os.environ.get('IMPORT_BUDGET_SECONDS', 3.0))
+lazy_modules = ['geopandas', 'shapely', 'pyogrio', 'fiona', 'matplotlib', 'folium', 'branca']
+
+IMPORTED_MARKER = 'dashboard imported'
+probe = f"""
+import sys, json
+import dashboard
+sys.stderr.write({IMPORTED_MARKER!r} + '\\n')
+from functions.folium_store import wait_for_folium_artifact_builds
+from functions.benchmark import layout_values, callback_request
+
+wait_for_folium_artifact_builds()
+value = layout_values(dashboard.app.layout())
+client = dashboard.app.server.test_client()
+for output, spec in dashboard.app.callback_map.items():
+    if 'callback' not in spec:
+        continue
+    response = client.post('/_dash-update-component', data=callback_request(output, spec, value), content_type='application/json')
+    assert response.status_code == 200, (output, response.status_code)
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def parse_importtime(lines):
+    # [(module, self seconds, depth)] in the order python -X importtime prints them
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us) / 1e6, len(name) - len(name.lstrip())))
+    return imports
+
+
+def import_chain(imports, module):
+    # module, then the modules that imported it up to the top level (children print first)
+    for i, (name, _, depth) in enumerate(imports):
+        if name == module:
+            chain = [name]
+            for parent, _, parent_depth in imports[i + 1:]:
+                if parent_depth < depth:
+                    chain.append(parent)
+                    depth = parent_depth
+            return chain
+    return [module]
+
+
+def check_imports(budget=IMPORT_BUDGET_SECONDS, cwd='.'):
+    env = dict(os.environ, DATA_RELOAD_INTERVAL='0')
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=cwd, env=env,
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"dashboard probe failed:\n{completed.stderr[-2000:]}")
+
+    stderr = completed.stderr.splitlines()
+    marker = stderr.index(IMPORTED_MARKER)
+    startup_imports = parse_importtime(stderr[:marker])
+    all_imports = parse_importtime(stderr)
+
+    # The dashboard module's own time is building the data snapshot, not importing
+    by_package = defaultdict(float)
+    for name, seconds, _ in startup_imports:
+        if name != 'dashboard':
+            by_package[name.split('.')[0]] += seconds
+    loaded = json.loads(completed.stdout.splitlines()[-1])
+    return {
+        'seconds': sum(by_package.values()),
+        'budget': budget,
+        'packages': sorted(by_package.items(), key=lambda item: -item[1]),
+        'lazy_loaded': {m: import_chain(all_imports, m) for m in lazy_modules if m in loaded}
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the dashboard's import time and lazily imported modules")
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_SECONDS, help="seconds (IMPORT_BUDGET_SECONDS)")
+    args = parser.parse_args()
+
+    report = check_imports(args.budget)
+    print(f"dashboard imports: {report['seconds']:.2f}s (budget {report['budget']:.2f}s)")
+    for package, seconds in report['packages'][:10]:
+        print(f"  {package:<30} {seconds:.3f}s")
+    for module, chain in report['lazy_loaded'].items():
+        print(f"  {module} should be lazy, imported by: {' <- '.join(chain)}")
+
+    if report['seconds'] > report['budget'] or report['lazy_loaded']:
+        sys.exit(1)
@@ -194,7 +194,9 @@ def create_layout_v2(data):
                     type='graph',
                     color="#8afa7c",
                     fullscreen=False
-                )
+                ),
+                # Arrow traces in the figure the browser holds, so updates can patch it
+                dcc.Store(id='arrow-map-state')
             ])
         ], style={
             'border': '1px solid #d9d9d9',
@@ -235,7 +237,9 @@ def create_layout_v2(data):
                     children=dcc.Graph(id='industry-bar-chart', style={'width': '100%', 'height': '400px'}),
                     type='graph',
                     fullscreen=False
-                )
+                ),
+                # Counts and amounts of every country, the chart is drawn from them in the browser
+                dcc.Store(id='industry-bar-data')
             ], style={'marginBottom': '40px'}),
 
             html.Div([
@@ -284,7 +288,10 @@ def create_layout_v2(data):
                     fullscreen=False,
                     color="#ff5733",
                     style={'marginTop': '20px'}
-                )
+                ),
+                # Date range the top panel is zoomed to, and the window width its lines are sized to
+                dcc.Store(id='transactions-over-time-range'),
+                dcc.Store(id='viewport-width')
             ])
         ], style={
             'border': '1px solid #d9d9d9',
@@ -0,0 +1,81 @@
+import os
+import json
+import resource
+
+from flask import Response
+
+# Shared vs private memory of the current process, from /proc/self/smaps_rollup (Linux).
+# With gunicorn's preload_app the data layer is built once in the master and the workers
+# share its pages copy-on-write: a worker's "private" memory is what it actually adds.
+
+MEMORY_ROUTE = '/memory'
+
+smaps_fields = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared',
+    'Shared_Dirty': 'shared',
+    'Private_Clean': 'private',
+    'Private_Dirty': 'private'
+}
+
+
+def memory_report(pid='self'):
+    report = {'pid': os.getpid() if pid == 'self' else pid}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return report
+
+    for line in lines:
+        parts = line.split()
+        field = parts[0].rstrip(':') if parts else None
+        if field in smaps_fields:
+            key = f"{smaps_fields[field]}_mb"
+            report[key] = round(report.get(key, 0) + int(parts[1]) / 1024, 1)
+    return report
+
+
+def reset_peak_rss():
+    # Restarts the process' peak RSS (VmHWM) so peak_rss_mb measures the code that follows
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # Peak of the whole process life, where /proc is not available
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def format_memory_report(report):
+    if 'rss_mb' not in report:
+        return f"pid {report['pid']}: memory report not available"
+    return (f"pid {report['pid']}: rss {report['rss_mb']:.1f} MB, pss {report['pss_mb']:.1f} MB, "
+            f"shared {report['shared_mb']:.1f} MB, private {report['private_mb']:.1f} MB")
+
+
+def register_memory_route(server):
+    @server.route(MEMORY_ROUTE)
+    def worker_memory():
+        return Response(json.dumps(memory_report()), content_type='application/json')
+
+    return MEMORY_ROUTE
+
+
+if __name__ == '__main__':
+    import sys
+
+    for pid in sys.argv[1:] or ['self']:
+        print(format_memory_report(memory_report(pid)))
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import logging
+import functools
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from dash import Patch
+from dash.exceptions import PreventUpdate
+from flask import Response, g, request
+
+# Per-callback instrumentation: latency histograms of every dashboard callback request, split
+# into its phases (data layer query, figure building, compressing the response, and what is
+# left of the request once the callback returned: Dash serializing the response), the response
+# size before and after compression and the trace count of the figures returned, rendered as
+# Prometheus text on /metrics. Collectors add
+# values read at scrape time (figure cache, data snapshot, memory). Every gunicorn worker
+# keeps its own metrics, a scrape reports the worker that answers it, like /memory.
+# METRICS_LOG (a file path, or - for stderr) also logs every callback request as a JSON line.
+
+METRICS_ROUTE = '/metrics'
+DASH_CALLBACK_ROUTE = '/_dash-update-component'
+
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (1_000, 10_000, 100_000, 300_000, 1_000_000, 3_000_000, 10_000_000, 30_000_000)
+trace_buckets = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> per bucket counts (last one +Inf), sum
+        self.values = {}
+
+    def observe(self, value, labels):
+        counts, total = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0.0)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.values[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetrics:
+    def __init__(self, log_path=None):
+        self._lock = threading.Lock()
+        # The callback running on this thread and the phases timed so far
+        self._local = threading.local()
+        self.collectors = []
+        self.errors = {}
+        self.latency = Histogram('dash_callback_duration_seconds', "Callback request latency, from request to response", latency_buckets)
+        self.phases = Histogram('dash_callback_phase_duration_seconds', "Callback time by phase: query, figure, serialize, compress", latency_buckets)
+        self.response_size = Histogram('dash_callback_response_bytes', "Size of the callback response body", size_buckets)
+        self.wire_size = Histogram('dash_callback_response_wire_bytes', "Size of the callback response as sent, after compression", size_buckets)
+        self.traces = Histogram('dash_callback_figure_traces', "Traces in the figures returned by a callback", trace_buckets)
+
+        self.log = None
+        if log_path:
+            self.log = logging.getLogger(f"{__name__}.callbacks")
+            self.log.setLevel(logging.INFO)
+            self.log.propagate = False
+            self.log.addHandler(logging.StreamHandler() if log_path == '-' else logging.FileHandler(log_path))
+
+    @classmethod
+    def from_env(cls):
+        return cls(log_path=os.environ.get('METRICS_LOG') or None)
+
+    def instrument(self, func):
+        # Under @app.callback: times the callback and the figures it returns
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = {'callback': func.__name__, 'phases': {}, 'traces': 0}
+            self._local.record = record
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                record['error'] = True
+                raise
+            finally:
+                record['seconds'] = time.perf_counter() - start
+            for output in result if isinstance(result, tuple) else (result,):
+                if isinstance(output, Patch):
+                    continue
+                data = output.get('data') if isinstance(output, dict) else getattr(output, 'data', None)
+                if isinstance(data, (list, tuple)):
+                    record['traces'] += len(data)
+            if record['traces']:
+                with self._lock:
+                    self.traces.observe(record['traces'], (('callback', record['callback']),))
+            return result
+        return wrapper
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe_phase(getattr(self._local, 'record', None), name, time.perf_counter() - start)
+
+    def _observe_phase(self, record, name, seconds):
+        if record is None:
+            return
+        record['phases'][name] = record['phases'].get(name, 0) + seconds
+        with self._lock:
+            self.phases.observe(seconds, (('callback', record['callback']), ('phase', name)))
+
+    def _before_request(self):
+        self._local.record = None
+        self._local.start = time.perf_counter()
+
+    def _after_request(self, response):
+        if request.path != DASH_CALLBACK_ROUTE:
+            return response
+        seconds = time.perf_counter() - getattr(self._local, 'start', time.perf_counter())
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            # Not an instrumented callback (or an invalid request): not labelled with anything
+            # the client sent, which would let it create any number of series
+            record = {'callback': 'unknown', 'phases': {}, 'traces': 0, 'seconds': 0}
+        self._local.record = None
+        labels = (('callback', record['callback']),)
+        wire_size = response.calculate_content_length() or 0
+        # Left by the compression (functions/serialization.py), which runs first
+        compression = g.pop('response_compression', None) or {'bytes': wire_size, 'seconds': 0}
+        size = compression['bytes']
+
+        if compression['seconds']:
+            self._observe_phase(record, 'compress', compression['seconds'])
+        self._observe_phase(record, 'serialize', max(seconds - record['seconds'] - compression['seconds'], 0))
+        with self._lock:
+            self.latency.observe(seconds, labels)
+            self.response_size.observe(size, labels)
+            self.wire_size.observe(wire_size, labels)
+            if response.status_code >= 400 or record.get('error'):
+                self.errors[labels] = self.errors.get(labels, 0) + 1
+
+        if self.log is not None:
+            self.log.info(json.dumps({
+                'time': round(time.time(), 3),
+                'pid': os.getpid(),
+                'callback': record['callback'],
+                'status': response.status_code,
+                'seconds': round(seconds, 6),
+                'phases': {name: round(value, 6) for name, value in record['phases'].items()},
+                'bytes': size,
+                'wire_bytes': wire_size,
+                'traces': record['traces']
+            }))
+        return response
+
+    def add_collector(self, collector):
+        # collector() -> [(name, type, help, [(labels, value), ...]), ...], called on every scrape
+        self.collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in (self.latency, self.phases, self.response_size, self.wire_size, self.traces):
+                lines += histogram.render()
+            lines += ["# HELP dash_callback_errors_total Callback requests that failed", "# TYPE dash_callback_errors_total counter"]
+            lines += [f"dash_callback_errors_total{_labels(labels)} {count}" for labels, count in sorted(self.errors.items())]
+        for collector in self.collectors:
+            for name, kind, help, samples in collector():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_labels(tuple(labels.items()))} {value}" for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+    def register_routes(self, server):
+        server.before_request(self._before_request)
+        server.after_request(self._after_request)
+
+        @server.route(METRICS_ROUTE)
+        def metrics():
+            return Response(self.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+        return METRICS_ROUTE
+
+
+def figure_cache_collector(cache):
+    def collect():
+        stats = cache.stats()
+        lookups = [({'function': function, 'result': result}, count)
+                   for function, counts in sorted(cache.function_stats.items()) for result, count in counts.items()]
+        return [
+            ('figure_cache_lookups_total', 'counter', "Figure cache lookups by memoized function and result", lookups),
+            ('figure_cache_evictions_total', 'counter', "Figures evicted from the in-memory cache", [({}, stats['evictions'])]),
+            ('figure_cache_entries', 'gauge', "Figures in the in-memory cache", [({}, stats['size'])])
+        ]
+    return collect
+
+
+def memory_collector(memory_report):
+    def collect():
+        report = memory_report()
+        samples = [({'kind': kind}, round(report[f"{kind}_mb"] * 2**20)) for kind in ('rss', 'pss', 'shared', 'private')
+                   if f"{kind}_mb" in report]
+        return [('process_memory_bytes', 'gauge', "Memory of the worker answering the scrape", samples)]
+    return collect
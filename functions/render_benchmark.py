@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Rendering benchmark of the over-time panels, SVG (go.Scatter) against WebGL (go.Scattergl):
+# builds the make_transaction_over_time figure with lines of growing length, with both trace
+# types, and times the figure build and its JSON serialization (as dash sends it), with the size
+# of the payload. The browser side can't be timed from python: the run also writes an HTML page
+# (plotly.js inlined, works offline) that draws every figure, then zooms it like a relayout
+# does, and shows those timings.
+#   python -m functions.render_benchmark --series 10 --points 500 2000 10000 50000
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RENDER_PAGE = os.path.join(ROOT, 'data', 'cache', 'benchmarks', 'render_benchmark.html')
+PATHS = {'svg': None, 'webgl': 0}
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        times.append(time.perf_counter() - start)
+    return value, min(times)
+
+
+def synthetic_series(countries, series, points, seed=0):
+    # series lines of `points` hourly values each, named after the countries (numbered past them)
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2013-01-01', periods=points, freq='h')
+    rolling_series = {}
+    for i in range(series):
+        name = countries[i % len(countries)] + (f" {i // len(countries) + 1}" if i >= len(countries) else '')
+        rolling_series[name] = (dates, 1e6 + np.cumsum(rng.normal(0, 1e4, points)))
+    return rolling_series
+
+
+def run_render_benchmark(series, points_list, repeat=3, page=RENDER_PAGE):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from plotly.io.json import to_json_plotly
+    from plotly.offline import get_plotlyjs
+    from functions.data_processing import DataManager, cube_frame, cube_values
+    from functions.graph import make_transaction_over_time
+
+    snapshot = DataManager().build_snapshot()
+    industries = cube_values(snapshot, 'Industry')
+    countries = cube_values(snapshot, 'Country')
+    cube = cube_frame(snapshot)
+    selected_date = pd.Timestamp(snapshot.date_index['dates'][0]).date()
+
+    results, figures = [], {}
+    print(f"{'figure':<24} {'build':>10} {'to JSON':>10} {'payload':>10}")
+    for points in points_list:
+        rolling_series = synthetic_series(countries, series, points)
+        for path, webgl_threshold in PATHS.items():
+            fig, build = best_time(lambda: make_transaction_over_time(
+                cube, snapshot.iso_a3_dict, industries, countries, 5, selected_date,
+                rolling_series=rolling_series, webgl_threshold=webgl_threshold), repeat)
+            payload, serialize = best_time(lambda: to_json_plotly(fig), repeat)
+            name = f"{series}x{points} {path}"
+            results.append({'figure': name, 'build_seconds': round(build, 6), 'serialize_seconds': round(serialize, 6),
+                            'payload_bytes': len(payload)})
+            figures[name] = payload
+            print(f"{name:<24} {build * 1000:>7.1f} ms {serialize * 1000:>7.1f} ms {len(payload) / 2**20:>7.2f} MB", flush=True)
+
+    os.makedirs(os.path.dirname(page), exist_ok=True)
+    with open(page, 'w') as f:
+        f.write(render_page(figures, results, get_plotlyjs(), repeat))
+    print(f"Browser timings: open {page}")
+    return results
+
+
+def render_page(figures, results, plotlyjs, repeat):
+    # Draws each figure `repeat` times (best kept): Plotly.newPlot until the next frame is painted,
+    # then a zoom to the middle half of the dates
+    figures_js = ',\n'.join(f"{json.dumps(name)}: {payload}" for name, payload in figures.items())
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Over-time panels: SVG vs WebGL</title>
+<script>{plotlyjs}</script></head>
+<body style="font-family: monospace">
+<pre id="results">figure                   build (py) to JSON (py) payload    draw      zoom
+</pre>
+<div id="plot" style="width: 1200px; height: 800px"></div>
+<script>
+var figures = {{
+{figures_js}
+}};
+var python = {json.dumps({r['figure']: r for r in results})};
+function painted() {{
+    return new Promise(function(resolve) {{ requestAnimationFrame(function() {{ setTimeout(resolve, 0); }}); }});
+}}
+function pad(text, width) {{
+    return (text + ' '.repeat(width)).slice(0, width);
+}}
+async function run() {{
+    var div = document.getElementById('plot');
+    for (var name in figures) {{
+        var figure = figures[name], draw = Infinity, zoom = Infinity;
+        var x = figure.data[0].x, range = [x[Math.floor(x.length / 4)], x[Math.floor(3 * x.length / 4)]];
+        for (var i = 0; i < {repeat}; i++) {{
+            Plotly.purge(div);
+            var start = performance.now();
+            await Plotly.newPlot(div, figure.data, figure.layout);
+            await painted();
+            draw = Math.min(draw, performance.now() - start);
+            start = performance.now();
+            await Plotly.relayout(div, {{'xaxis.range': range}});
+            await painted();
+            zoom = Math.min(zoom, performance.now() - start);
+        }}
+        var py = python[name];
+        document.getElementById('results').textContent += pad(name, 25)
+            + pad((py.build_seconds * 1000).toFixed(1) + ' ms', 11) + pad((py.serialize_seconds * 1000).toFixed(1) + ' ms', 11)
+            + pad((py.payload_bytes / 1048576).toFixed(2) + ' MB', 11)
+            + pad(draw.toFixed(1) + ' ms', 10) + zoom.toFixed(1) + ' ms\\n';
+    }}
+    Plotly.purge(div);
+    document.title = 'done';
+}}
+run();
+</script>
+</body></html>
+"""
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the over-time panels with SVG and WebGL traces")
+    parser.add_argument('--series', type=int, default=10, help="lines in the top panel")
+    parser.add_argument('--points', type=int, nargs='+', default=[500, 2000, 10000, 50000], help="points per line")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--page', default=RENDER_PAGE, help="HTML page with the browser timings")
+    args = parser.parse_args()
+    run_render_benchmark(args.series, args.points, args.repeat, args.page)
@@ -0,0 +1,137 @@
+import gzip
+import time
+import base64
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from flask import g, request
+
+try:
+    from _plotly_utils.utils import is_homogeneous_array, to_typed_array_spec
+except ImportError:
+    is_homogeneous_array = to_typed_array_spec = None
+
+# Encoding of the callback responses.
+# figure_to_dict is go.Figure.to_dict (the dict dash serializes, numeric arrays as plotly.js typed
+# arrays: base64 'bdata' with a 'dtype') without its two costs, a deep copy of the figure and the
+# per-array type detection: the figure's arrays are already validated read-only numpy arrays,
+# they are encoded straight from their buffers into new containers. Figures returned (and
+# memoized) as these dicts hold only JSON types, strings and numeric numpy arrays, which orjson
+# (plotly's 'auto' json engine when installed) writes in one pass, without plotly's cleaning
+# of every value it falls back to when orjson meets anything else.
+# It reads plotly internals (the figure's _data, _layout, _frame_objs and the frames' _props,
+# _plotly_utils' typed array helpers), checked with the plotly versions requirements.txt allows;
+# without them it falls back to fig.to_plotly_json(), the same dict at plotly's own cost.
+# register_compression gzips the responses the client accepts gzip for: callback JSON, the layout,
+# the page and the component bundles. Responses the client may cache (with an ETag or a max-age:
+# the fingerprinted dash bundles, the folium artifact) are the same bytes on every request to
+# their URL, their compressed body is kept. The original size and the
+# time spent compressing are left in flask.g for the callback metrics.
+
+# dtypes plotly.js reads as typed arrays, by their numpy name
+typed_array_dtypes = {'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4',
+                      'float32': 'f4', 'float64': 'f8'}
+# Integer types plotly.js has no typed array for, narrowed to the smallest that holds the values
+narrowed_dtypes = {'int64': (np.int8, np.int16, np.int32), 'uint64': (np.uint8, np.uint16, np.uint32)}
+# Keys plotly leaves as they are (geojson and mapbox layers, axis ranges)
+skipped_keys = {'geojson', 'layer', 'layers', 'range'}
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/css', 'text/javascript', 'application/javascript'}
+# Smaller responses don't gain from compression what the header costs
+COMPRESSION_MIN_BYTES = 500
+COMPRESSED_CACHE_SIZE = 64
+
+
+def figure_to_dict(fig):
+    if to_typed_array_spec is None or not all(hasattr(fig, name) for name in ('_data', '_layout', '_frame_objs')):
+        return fig.to_plotly_json()
+    figure = {'data': [_encode(trace) for trace in fig._data], 'layout': _encode(fig._layout)}
+    frames = [_encode(frame._props) for frame in fig._frame_objs]
+    if frames:
+        figure['frames'] = frames
+    return figure
+
+
+def typed_array(values):
+    # A numpy array as a plotly.js typed array; the arrays without one as plotly's json engines
+    # write them (strings and objects as lists, other numbers as they are), but for dates: ISO
+    # strings no longer than their precision needs ('2013-01-05', not '2013-01-05T00:00:00.000000000')
+    if values.dtype.kind == 'M':
+        return np.datetime_as_string(values, unit='auto').tolist()
+    if values.dtype.kind in 'UO':
+        return values.tolist()
+    if values.size == 0:
+        return values
+    dtype = values.dtype.name
+    if dtype in narrowed_dtypes:
+        low, high = values.min(), values.max()
+        narrowed = next((t for t in narrowed_dtypes[dtype] if np.iinfo(t).min <= low and high <= np.iinfo(t).max), None)
+        if narrowed is None:
+            return values
+        values, dtype = values.astype(narrowed), np.dtype(narrowed).name
+    if dtype not in typed_array_dtypes:
+        return values
+    spec = {'dtype': typed_array_dtypes[dtype], 'bdata': base64.b64encode(np.ascontiguousarray(values)).decode('ascii')}
+    if values.ndim > 1:
+        spec['shape'] = str(values.shape)[1:-1]
+    return spec
+
+
+def _encode(value):
+    # Copies of the containers with the arrays directly under a dict encoded, like convert_to_base64
+    if isinstance(value, dict):
+        return {key: item if key in skipped_keys else _encode_item(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_encode(item) for item in value)
+    return value
+
+
+def _encode_item(value):
+    if isinstance(value, np.ndarray):
+        return typed_array(value)
+    if isinstance(value, (dict, list, tuple)):
+        return _encode(value)
+    if is_homogeneous_array(value):
+        return to_typed_array_spec(value)
+    return value
+
+
+def register_compression(server, level=6, min_bytes=COMPRESSION_MIN_BYTES):
+    compressed_cache = OrderedDict()
+    lock = threading.Lock()
+
+    @server.after_request
+    def compress(response):
+        if (level <= 0 or response.direct_passthrough or response.status_code != 200
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES
+                or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+            return response
+        body = response.get_data()
+        if len(body) < min_bytes:
+            return response
+        start = time.perf_counter()
+        etag = response.headers.get('ETag')
+        cached = bool(etag or response.cache_control.max_age)
+        key = (request.full_path, etag)
+        with lock:
+            compressed = compressed_cache.get(key) if cached else None
+            if compressed is not None:
+                compressed_cache.move_to_end(key)
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=level, mtime=0)
+            if cached:
+                with lock:
+                    compressed_cache[key] = compressed
+                    while len(compressed_cache) > COMPRESSED_CACHE_SIZE:
+                        compressed_cache.popitem(last=False)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+        # The ETag stays the one dash compares If-None-Match with, the content varies by encoding
+        response.vary.add('Accept-Encoding')
+        g.response_compression = {'bytes': len(body), 'seconds': time.perf_counter() - start}
+        return response
+
+    return compress
@@ -0,0 +1,78 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from functions.transaction_store import TRANSACTIONS_CSV
+
+# Deterministic synthetic transactions with the schema of data/transactions.csv, to see how
+# the data layer and the figures behave at production sizes. The categorical columns are
+# resampled row-wise from the shipped file, so countries, industries, sources of money...
+# keep their joint frequencies; amounts follow its empirical distribution and the dates
+# cover its time span, denser as the row count grows. Same rows and seed, same file.
+
+SYNTHETIC_SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000, '100m': 100_000_000}
+
+resampled_columns = ['Country', 'Transaction Type', 'Industry', 'Destination Country', 'Reported by Authority',
+                     'Source of Money', 'Money Laundering Risk Score', 'Shell Companies Involved', 'Tax Haven Country']
+
+
+def synthetic_profile(source=TRANSACTIONS_CSV):
+    data = pd.read_csv(source)
+    dates = pd.to_datetime(data['Date of Transaction'])
+    id_number = lambda column: data[column].str.split('_').str[1].astype(int).max()
+    return {
+        'columns': data.columns.tolist(),
+        'rows': data[resampled_columns].reset_index(drop=True),
+        'amounts': np.sort(data['Amount (USD)'].to_numpy()),
+        'start': dates.min(),
+        'end': dates.max(),
+        'people': id_number('Person Involved'),
+        'institutions': id_number('Financial Institution')
+    }
+
+
+def synthetic_chunk(profile, first_row, rows, total_rows, seed=0):
+    # Rows [first_row, first_row + rows) of a file of total_rows, independent of the chunking
+    rng = np.random.default_rng([seed, first_row])
+    chunk = profile['rows'].iloc[rng.integers(0, len(profile['rows']), rows)].reset_index(drop=True)
+
+    # Inverse of the empirical CDF, interpolated so amounts are not repeats of the source ones
+    amounts = profile['amounts']
+    chunk['Amount (USD)'] = np.interp(rng.random(rows), np.linspace(0, 1, len(amounts)), amounts)
+
+    # Same span as the source, so more rows means more transactions per day
+    seconds_per_row = (profile['end'] - profile['start']).total_seconds() / total_rows
+    offsets = np.sort(rng.uniform(first_row, first_row + rows, rows)) * seconds_per_row
+    chunk['Date of Transaction'] = (profile['start'] + pd.to_timedelta(offsets.astype(np.int64), unit='s')).strftime('%Y-%m-%d %H:%M:%S')
+
+    # The population of people grows with the file, the banks stay the same
+    people = max(profile['people'], int(profile['people'] * total_rows / len(profile['rows'])))
+    chunk['Transaction ID'] = pd.Series(np.arange(first_row + 1, first_row + rows + 1)).map('TX{:010d}'.format)
+    chunk['Person Involved'] = 'Person_' + pd.Series(rng.integers(1, people + 1, rows)).astype(str)
+    chunk['Financial Institution'] = 'Bank_' + pd.Series(rng.integers(1, profile['institutions'] + 1, rows)).astype(str)
+    return chunk[profile['columns']]
+
+
+def generate_transactions(path, rows, seed=0, source=TRANSACTIONS_CSV, chunk_rows=500_000):
+    profile = synthetic_profile(source)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='') as f:
+        for first_row in range(0, rows, chunk_rows):
+            chunk = synthetic_chunk(profile, first_row, min(chunk_rows, rows - first_row), rows, seed)
+            chunk.to_csv(f, header=first_row == 0, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic transactions CSV")
+    parser.add_argument('size', help=f"row count or one of {', '.join(SYNTHETIC_SIZES)}")
+    parser.add_argument('path')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = SYNTHETIC_SIZES.get(args.size.lower()) or int(args.size)
+    print(f"{rows:,} transactions written to {generate_transactions(args.path, rows, args.seed)}")
@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Columnar cache of data/transactions.csv: the CSV is parsed once into a typed
+# Parquet file (categoricals, integer IDs, small integers, bools + datetime64 day
+# column) that every worker reads instead of re-running read_csv / to_datetime.
+# The cache is invalidated when the CSV's mtime changes and its content hash no
+# longer matches. Every worker may find it stale at once (a rewritten CSV): one
+# rebuilds it under a lock, the others wait and read what it wrote.
+#   python -m functions.transaction_store    (builds it, with the memory of every column)
+
+TRANSACTIONS_CSV = 'data/transactions.csv'
+TRANSACTIONS_STORE_PATH = 'data/cache/transactions.parquet'
+STORE_VERSION = 2
+
+categorical_columns = [
+    'Country',
+    'Industry',
+    'Transaction Type',
+    'Destination Country',
+    'Source of Money',
+    'Tax Haven Country'
+]
+
+# ID-like columns, a fixed prefix and a number ('TX0000000001', 'Person_1101', 'Bank_40'): kept as
+# the number, in the smallest unsigned integer type that holds it, and turned back into the text
+# by id_text. The width is the zero padding of the number (0: none). A column with any value of
+# another form stays text, as a categorical (its categories are the dictionary back to the text).
+id_columns = {
+    'Transaction ID': ('TX', 10),
+    'Person Involved': ('Person_', 0),
+    'Financial Institution': ('Bank_', 0)
+}
+
+# Downcast to the smallest integer type that holds their values
+small_integer_columns = ['Money Laundering Risk Score', 'Shell Companies Involved']
+
+csv_dtypes = {**{column: 'category' for column in categorical_columns}, 'Reported by Authority': 'bool'}
+
+
+def _meta_path(path):
+    return path + '.meta.json'
+
+
+def _write_meta(path, meta):
+    tmp_path = f"{_meta_path(path)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, _meta_path(path))
+
+
+def file_hash(csv_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _add_dates(data):
+    data['Date of Transaction'] = pd.to_datetime(data['Date of Transaction'])
+    data['Date'] = data['Date of Transaction'].dt.normalize()
+    return data
+
+
+def _encode_ids(values, prefix, width):
+    # The numbers of values in the prefix + number form, or None if any value is not in it.
+    # Checked and cast with arrow's kernels, pandas' string to int64 cast goes through python
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if values.empty or values.isna().any():
+        return None
+    text = pa.array(values.astype(str))
+    numbers = pc.utf8_slice_codeunits(text, len(prefix))
+    lengths = pc.utf8_length(numbers)
+    in_form = pc.and_(pc.starts_with(text, prefix), pc.ascii_is_decimal(numbers))
+    in_form = pc.and_(in_form, pc.less_equal(lengths, 18))
+    if width:
+        in_form = pc.and_(in_form, pc.equal(lengths, width))
+    else:
+        in_form = pc.and_(in_form, pc.or_(pc.equal(lengths, 1), pc.invert(pc.starts_with(numbers, '0'))))
+    if not pc.all(in_form).as_py():
+        return None
+    ids = pc.cast(numbers, pa.int64()).to_numpy()
+    return pd.Series(ids.astype(np.min_scalar_type(int(ids.max()))), index=values.index, name=values.name)
+
+
+def _encode_columns(data):
+    for column, (prefix, width) in id_columns.items():
+        ids = _encode_ids(data[column], prefix, width)
+        data[column] = data[column].astype('category') if ids is None else ids
+    for column in small_integer_columns:
+        data[column] = pd.to_numeric(data[column], downcast='unsigned' if data[column].min() >= 0 else 'integer')
+    return data
+
+
+def id_text(values, column):
+    # The text of an ID column, as in the CSV
+    if not pd.api.types.is_integer_dtype(values):
+        return values.astype(str)
+    prefix, width = id_columns[column]
+    return prefix + values.astype(str).str.zfill(width)
+
+
+def decode_columns(data):
+    # The frame with the columns typed as read_csv infers them, for comparisons
+    decoded = data.copy()
+    for column in id_columns:
+        decoded[column] = id_text(data[column], column)
+    for column in small_integer_columns:
+        decoded[column] = data[column].astype('int64')
+    return decoded
+
+
+def parse_transactions_csv(csv_path=TRANSACTIONS_CSV):
+    data = pd.read_csv(csv_path, dtype=csv_dtypes)
+    return _encode_columns(_add_dates(data))
+
+
+class HashingReader:
+    # Binary file wrapper that hashes and counts the bytes read through it, so a single pass
+    # of read_csv also gives the content hash and size of what was ingested
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        return self._count(self.f.read(size))
+
+    def readline(self, size=-1):
+        return self._count(self.f.readline(size))
+
+    def __iter__(self):
+        # read_csv only accepts iterable file objects
+        return iter(self.readline, b'')
+
+    def _count(self, chunk):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def iter_transactions_csv(f, chunk_rows):
+    # Same typed frames as parse_transactions_csv, chunk_rows rows at a time. Row labels run
+    # on across chunks, like the index of the whole file.
+    start = 0
+    with pd.read_csv(f, chunksize=chunk_rows, dtype=csv_dtypes) as reader:
+        for chunk in reader:
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield _encode_columns(_add_dates(chunk))
+
+
+def build_transactions_store(csv_path=TRANSACTIONS_CSV, path=TRANSACTIONS_STORE_PATH, csv_hash=None):
+    data = parse_transactions_csv(csv_path)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    data.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    stat = os.stat(csv_path)
+    meta = {
+        'version': STORE_VERSION,
+        'csv_mtime': stat.st_mtime,
+        'csv_size': stat.st_size,
+        'csv_sha256': csv_hash or file_hash(csv_path)
+    }
+    _write_meta(path, meta)
+    return data
+
+
+def is_store_fresh(csv_path=TRANSACTIONS_CSV, path=TRANSACTIONS_STORE_PATH):
+    # Returns (fresh, csv_hash). The hash is only computed when the mtime moved,
+    # so a touched-but-unchanged CSV keeps its cache.
+    if not (os.path.exists(path) and os.path.exists(_meta_path(path))):
+        return False, None
+    with open(_meta_path(path)) as f:
+        meta = json.load(f)
+    if meta.get('version') != STORE_VERSION:
+        return False, None
+
+    stat = os.stat(csv_path)
+    if meta['csv_mtime'] == stat.st_mtime and meta['csv_size'] == stat.st_size:
+        return True, meta['csv_sha256']
+
+    csv_hash = file_hash(csv_path)
+    if csv_hash != meta['csv_sha256']:
+        return False, csv_hash
+
+    meta['csv_mtime'], meta['csv_size'] = stat.st_mtime, stat.st_size
+    _write_meta(path, meta)
+    return True, csv_hash
+
+
+def read_store_meta(path=TRANSACTIONS_STORE_PATH):
+    try:
+        with open(_meta_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def concat_transactions(frames):
+    # pd.concat turns categoricals with different categories into object columns, so every frame
+    # first gets the union of the categories: new ones are appended, or sorted in if the first
+    # frame's were sorted (what read_csv gives for the whole file). Frames that already have
+    # them, usually the large existing one, are left untouched.
+    frames = list(frames)
+    for column in frames[0].columns:
+        dtypes = [frame[column].dtype for frame in frames]
+        if not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            continue
+        categories = dtypes[0].categories
+        for dtype in dtypes[1:]:
+            categories = categories.append(dtype.categories.difference(categories, sort=False))
+        if len(categories) > len(dtypes[0].categories) and dtypes[0].categories.is_monotonic_increasing:
+            categories = categories.sort_values()
+        frames = [frame if dtype.categories.equals(categories)
+                  else frame.assign(**{column: frame[column].cat.set_categories(categories)})
+                  for frame, dtype in zip(frames, dtypes)]
+    return pd.concat(frames)
+
+
+def load_transactions_store(csv_path=TRANSACTIONS_CSV, path=TRANSACTIONS_STORE_PATH):
+    fresh, csv_hash = is_store_fresh(csv_path, path)
+    if not fresh:
+        # Only one process builds, the others wait for it and read its store
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fresh, csv_hash = is_store_fresh(csv_path, path)
+            if not fresh:
+                return build_transactions_store(csv_path, path, csv_hash)
+    return pd.read_parquet(path)
+
+
+def column_memory_report(data):
+    # Bytes per row of every column with the ID and small integer columns as read_csv infers them
+    # (before) and as stored (after), and the time of a groupby over each ID column with both
+    before = decode_columns(data)
+    rows = max(len(data), 1)
+    lines = [f"{'bytes per row':<36} {'before':>10} {'after':>10}"]
+    for column in data.columns:
+        lines.append(f"{column:<36} {before[column].memory_usage(deep=True, index=False) / rows:>10.1f} "
+                     f"{data[column].memory_usage(deep=True, index=False) / rows:>10.1f}")
+    lines.append(f"{'total (MB)':<36} {before.memory_usage(deep=True).sum() / 1e6:>10.1f} {data.memory_usage(deep=True).sum() / 1e6:>10.1f}")
+    for column in id_columns:
+        seconds = [min(_timed_groupby(frame, column) for _ in range(3)) for frame in (before, data)]
+        lines.append(f"{'groupby ' + column + ' (ms)':<36} {seconds[0] * 1000:>10.1f} {seconds[1] * 1000:>10.1f}")
+    return '\n'.join(lines)
+
+
+def _timed_groupby(data, column):
+    start = time.perf_counter()
+    data.groupby(column, observed=True)['Amount (USD)'].sum()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    data = build_transactions_store()
+    print(f"Transactions store with {len(data):,} rows written to {TRANSACTIONS_STORE_PATH} "
+          f"({data.memory_usage(deep=True).sum() / 1e6:.1f} MB in memory)")
+    print(column_memory_report(data))
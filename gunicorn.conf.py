@@ -0,0 +1,33 @@
+import gc
+import os
+import logging
+
+from functions.memory_report import memory_report, format_memory_report
+
+# The app (transactions, geometries, cube, prefix sums, flow tensor) is built once in the
+# master and the forked workers share those pages copy-on-write, so adding workers costs
+# only each worker's private memory instead of a full copy of the data layer.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Callbacks only read the immutable DataSnapshot, so a worker can serve requests on threads
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 300
+preload_app = True
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def when_ready(server):
+    from functions.folium_store import wait_for_folium_artifact_builds
+
+    wait_for_folium_artifact_builds()
+    # Move everything built so far out of the collector's reach: a collection in a worker
+    # would otherwise write to every object header and un-share their pages
+    gc.collect()
+    gc.freeze()
+    logger.info("master %s", format_memory_report(memory_report()))
+
+
+def post_worker_init(worker):
+    logger.info("worker %s", format_memory_report(memory_report()))